@@ -40,7 +40,10 @@ class KH(Hydro):
             rho * u,
             rho * v,
             self.E((rho, u, v, p))
-        ]).transpose((1, 2, 0))
+        ])
+
+    def variables_first(self) -> bool:
+        return True
 
     def theta_PLM(self) -> float:
         return 2
@@ -60,6 +63,12 @@ class KH(Hydro):
     def save_interval(self) -> float:
         return 0.01
 
+    def checkpoint_compression(self) -> str:
+        return "gzip"
+
+    def checkpoint_dtype(self) -> str:
+        return "float32"
+
     def range(self) -> tuple[tuple[float, float], tuple[float, float]]:
         return ((-0.5, 0.5), (-0.5, 0.5))
 
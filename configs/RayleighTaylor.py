@@ -28,7 +28,10 @@ class RayleighTaylor(Hydro):
             jnp.zeros_like(x),
             rho * v,
             self.E((rho, 0, v, p))
-        ]).transpose((1, 2, 0))
+        ])
+
+    def variables_first(self) -> bool:
+        return True
 
     def gamma(self) -> float:
         return self.gamma_ad
@@ -58,8 +61,8 @@ class RayleighTaylor(Hydro):
         return ("reflective", "reflective")
 
     def source(self, U: ArrayLike, X1: ArrayLike, X2: ArrayLike, t: float) -> Array:
-        rho = U[..., 0]
-        v = U[..., 2] / rho
+        rho = U[0]
+        v = U[2] / rho
         zero = jnp.zeros_like(rho)
         
         return jnp.array([
@@ -67,4 +70,4 @@ class RayleighTaylor(Hydro):
             zero,
             rho * self.g,
             rho * (self.g * v)
-        ]).transpose((1, 2, 0))
\ No newline at end of file
+        ])
\ No newline at end of file
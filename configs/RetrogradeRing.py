@@ -5,7 +5,7 @@ from jax.typing import ArrayLike
 from jax import Array, jit
 import jax.numpy as jnp
 
-from meena import Hydro, Lattice, Primitives, Conservatives, BoundaryCondition, Coords
+from meena import Hydro, Lattice, Primitives, Conservatives, BoundaryCondition, Diagnostic, Coords
 
 @partial(jit, static_argnames=["hydro", "lattice"])
 def get_accr_rate(hydro: Hydro, lattice: Lattice, U: ArrayLike, flux: tuple[ArrayLike, ArrayLike, ArrayLike, ArrayLike], t: float) -> float:
@@ -13,7 +13,7 @@ def get_accr_rate(hydro: Hydro, lattice: Lattice, U: ArrayLike, flux: tuple[Arra
     dtheta = lattice.x2_intf[1] - lattice.x2_intf[0]
     dA = lattice.x1[0] * dr * dtheta
     F_l, F_r, G_l, G_r = flux
-    m_dot = -(F_l[0, :, 0] / dr) * dA
+    m_dot = -(F_l[0, 0, :] / dr) * dA
     return jnp.sum(m_dot)
 
 
@@ -23,8 +23,8 @@ def get_angular_mom_rate(hydro: Hydro, lattice: Lattice, U: ArrayLike, flux: tup
     dtheta = lattice.x2_intf[1] - lattice.x2_intf[0]
     dA = lattice.x1[0] * dr * dtheta
     F_l, F_r, G_l, G_r = flux
-    m_dot = -(F_l[0, :, 0] / dr) * dA
-    vtheta = U[0, :, 2] / U[0, :, 0]
+    m_dot = -(F_l[0, 0, :] / dr) * dA
+    vtheta = U[2, 0, :] / U[0, 0, :]
     return jnp.sum(m_dot * lattice.x1[0] * vtheta)
 
 
@@ -32,14 +32,10 @@ def get_angular_mom_rate(hydro: Hydro, lattice: Lattice, U: ArrayLike, flux: tup
 @partial(jit, static_argnames=["hydro", "lattice"])
 def get_torque1(hydro: Hydro, lattice: Lattice, U: ArrayLike, flux: tuple[ArrayLike, ArrayLike, ArrayLike, ArrayLike], t: float) -> float:
     x1_1, x2_1, x1_2, x2_2 = hydro.get_positions(t)
-    rho = U[..., 0]
+    rho = U[0]
     r, theta = lattice.X1, lattice.X2
     r_bh, theta_bh = x1_1, x2_1
-    R_interf, _ = jnp.meshgrid(lattice.x1_intf, lattice.x2, indexing="ij")
-    x1_l, x1_r = R_interf[:-1, :], R_interf[1:, :]
-    dx1 = x1_r - x1_l
-    dx2 = lattice.x2[1] - lattice.x2[0]
-    dA = r * dx1 * dx2
+    dA = lattice.dV
     
     delta_theta = theta - theta_bh
     dist = jnp.sqrt(r ** 2 + r_bh ** 2 - 2 * r *
@@ -54,14 +50,10 @@ def get_torque1(hydro: Hydro, lattice: Lattice, U: ArrayLike, flux: tuple[ArrayL
 @partial(jit, static_argnames=["hydro", "lattice"])
 def get_torque2(hydro: Hydro, lattice: Lattice, U: ArrayLike, flux: tuple[ArrayLike, ArrayLike, ArrayLike, ArrayLike], t: float) -> float:
     x1_1, x2_1, x1_2, x2_2 = hydro.get_positions(t)
-    rho = U[..., 0]
+    rho = U[0]
     r, theta = lattice.X1, lattice.X2
     r_bh, theta_bh = x1_2, x2_2
-    R_interf, _ = jnp.meshgrid(lattice.x1_intf, lattice.x2, indexing="ij")
-    x1_l, x1_r = R_interf[:-1, :], R_interf[1:, :]
-    dx1 = x1_r - x1_l
-    dx2 = lattice.x2[1] - lattice.x2[0]
-    dA = r * dx1 * dx2  # dA = rdrdtheta
+    dA = lattice.dV  # dA = rdrdtheta
 
     delta_theta = theta - theta_bh
     dist = jnp.sqrt(r ** 2 + r_bh ** 2 - 2 * r *
@@ -74,14 +66,10 @@ def get_torque2(hydro: Hydro, lattice: Lattice, U: ArrayLike, flux: tuple[ArrayL
     return T
 
 def get_eccentricity(hydro: Hydro, lattice: Lattice, U: ArrayLike, flux: tuple[ArrayLike, ArrayLike, ArrayLike, ArrayLike], t: float):
-    rho = U[..., 0]
-    vr, vtheta = U[..., 1] / rho, U[..., 2] / rho
+    rho = U[0]
+    vr, vtheta = U[1] / rho, U[2] / rho
     r, theta = lattice.X1, lattice.X2
-    R_interf, _ = jnp.meshgrid(lattice.x1_intf, lattice.x2, indexing="ij")
-    x1_l, x1_r = R_interf[:-1, :], R_interf[1:, :]
-    dx1 = x1_r - x1_l
-    dx2 = lattice.x2[1] - lattice.x2[0]
-    dA = r * dx1 * dx2
+    dA = lattice.dV
     e_x = (r * vr * vtheta / (hydro.G * hydro.M)) * jnp.sin(theta) + \
         (((r * vtheta ** 2) / (hydro.G * hydro.M)) - 1) * jnp.cos(theta)
     e_y = -(r * vr * vtheta / (hydro.G * hydro.M)) * jnp.cos(theta) + \
@@ -95,16 +83,6 @@ def get_eccentricity(hydro: Hydro, lattice: Lattice, U: ArrayLike, flux: tuple[A
     return (ec_x, ec_y)
 
 
-@partial(jit, static_argnames=["hydro", "lattice"])
-def get_eccentricity_x(hydro: Hydro, lattice: Lattice, U: ArrayLike, flux: tuple[ArrayLike, ArrayLike, ArrayLike, ArrayLike], t: float):
-    return get_eccentricity(hydro, lattice, U, flux, t)[0]
-
-
-@partial(jit, static_argnames=["hydro", "lattice"])
-def get_eccentricity_y(hydro: Hydro, lattice: Lattice, U: ArrayLike, flux: tuple[ArrayLike, ArrayLike, ArrayLike, ArrayLike], t: float):
-    return get_eccentricity(hydro, lattice, U, flux, t)[1]
-
-
 @dataclass(frozen=True)
 class RetrogradeRing(Hydro):
     G: float = 1
@@ -136,8 +114,11 @@ class RetrogradeRing(Hydro):
             rho * v_r,
             rho * v_theta,
             self.E((rho, v_r, v_theta, jnp.zeros_like(rho)), X1, X2, t)
-        ]).transpose((1, 2, 0))
+        ])
                 
+    def variables_first(self) -> bool:
+        return True
+
     def range(self) -> tuple[tuple[float, float], tuple[float, float]]:
         return ((0.6 * self.a, 10), (0, 2 * jnp.pi))
 
@@ -169,13 +150,21 @@ class RetrogradeRing(Hydro):
     def bc_x2(self) -> BoundaryCondition:
         return ("periodic", "periodic")
 
-    def E(self, prims: Primitives, X1: ArrayLike, X2: ArrayLike, t: float) -> Array:
+    def cached_fields(self, X1: ArrayLike, X2: ArrayLike, t: float) -> dict[str, Array]:
+        return {"c_s": self._c_s_field(X1, X2, t)}
+
+    def E(self, prims: Primitives, X1: ArrayLike, X2: ArrayLike, t: float, fields: dict[str, Array] = None) -> Array:
         rho, u, v, p = prims
-        e_internal = rho * (self.c_s(prims, X1, X2, t) ** 2)
+        e_internal = rho * (self.c_s(prims, X1, X2, t, fields) ** 2)
         e_kinetic = 0.5 * rho * (u ** 2 + v ** 2)
         return e_internal + e_kinetic
 
-    def c_s(self, prims: Primitives, X1: ArrayLike, X2: ArrayLike, t: float) -> Array:
+    def c_s(self, prims: Primitives, X1: ArrayLike, X2: ArrayLike, t: float, fields: dict[str, Array] = None) -> Array:
+        if fields is not None:
+            return fields["c_s"]
+        return self._c_s_field(X1, X2, t)
+
+    def _c_s_field(self, X1: ArrayLike, X2: ArrayLike, t: float) -> Array:
         x1_1, x2_1, x1_2, x2_2 = self.get_positions(t)
         r, theta = X1, X2
         r1, theta1 = x1_1, x2_1
@@ -190,9 +179,9 @@ class RetrogradeRing(Hydro):
                        (self.G * (self.M / 2) / jnp.sqrt(dist2 ** 2 + self.eps ** 2))) / (self.mach ** 2))
         return cs
 
-    def P(self, cons: Conservatives, X1: ArrayLike, X2: ArrayLike, t: float) -> Array:
+    def P(self, cons: Conservatives, X1: ArrayLike, X2: ArrayLike, t: float, fields: dict[str, Array] = None) -> Array:
         rho, _, _, _ = cons
-        return rho * self.c_s(cons, X1, X2, t) ** 2
+        return rho * self.c_s(cons, X1, X2, t, fields) ** 2
 
     def BH_gravity(self, U, r, theta, r_bh, theta_bh):
         delta_theta = theta - theta_bh
@@ -202,17 +191,17 @@ class RetrogradeRing(Hydro):
 
         g_r = g_acc * (r - r_bh * jnp.cos(delta_theta)) / dist
         g_theta = g_acc * (r_bh * jnp.sin(delta_theta)) / dist
-        rho = U[..., 0]
-        u, v = U[..., 1] / rho, U[..., 2] / rho
+        rho = U[0]
+        u, v = U[1] / rho, U[2] / rho
 
         return jnp.array([
             jnp.zeros_like(rho),
             rho * g_r,
             rho * g_theta,
             rho * (u * g_r + v * g_theta)
-        ]).transpose((1, 2, 0))
+        ])
 
-    def source(self, U: ArrayLike, X1, X2, t: float) -> Array:
+    def source(self, U: ArrayLike, X1, X2, t: float, fields: dict[str, Array] = None) -> Array:
         x1_1, x2_1, x1_2, x2_2 = self.get_positions(t)
         S = jnp.zeros_like(U)
         S = S + self.BH_gravity(U, X1, X2, x1_1, x2_1)
@@ -228,23 +217,21 @@ class RetrogradeRing(Hydro):
 
         return x1_1, x2_1, x1_2, x2_2
 
-    # assumes U with ghost cells
-    def check_U(self, lattice: Lattice, U: ArrayLike, t: float) -> Array:
-        g = lattice.num_g
-        rho = U[:, :, 0]
-        vr = U[:, :, 1] / rho
-        vr = vr.at[:g, :].set(jnp.minimum(vr[:g, :], 0))
-        U = U.at[:g, :, 1].set(rho[:g, :] * vr[:g, :])
-        return U
+    # no inflow through the inner boundary
+    def check_ghosts(self, lattice: Lattice, ghosts: tuple[Array, Array, Array, Array], t: float) -> tuple[Array, Array, Array, Array]:
+        x1_l, x1_r, x2_l, x2_r = ghosts
+        rho = x1_l[0]
+        vr = jnp.minimum(x1_l[1] / rho, 0)
+        x1_l = x1_l.at[1].set(rho * vr)
+        return x1_l, x1_r, x2_l, x2_r
 
     def diagnostics(self):
         diagnostics = []
-        diagnostics.append(("m_dot", get_accr_rate))
-        diagnostics.append(("L_dot", get_angular_mom_rate))
-        diagnostics.append(("torque_1", get_torque1))
-        diagnostics.append(("torque_2", get_torque1))
-        diagnostics.append(("e_x", get_eccentricity_x))
-        diagnostics.append(("e_y", get_eccentricity_y))
+        diagnostics.append(Diagnostic("m_dot", get_accr_rate))
+        diagnostics.append(Diagnostic("L_dot", get_angular_mom_rate))
+        diagnostics.append(Diagnostic("torque_1", get_torque1, flux=False))
+        diagnostics.append(Diagnostic("torque_2", get_torque1, flux=False))
+        diagnostics.append(Diagnostic(("e_x", "e_y"), get_eccentricity, flux=False))
         return diagnostics
 
     def save_interval(self):
@@ -5,7 +5,7 @@ from jax.typing import ArrayLike
 from jax import Array, jit
 import jax.numpy as jnp
 
-from meena import Hydro, Lattice, Primitives, Conservatives, BoundaryCondition
+from meena import Hydro, Lattice, Primitives, Conservatives, BoundaryCondition, Diagnostic
 from src.common.helpers import cartesian_to_polar, get_prims
 
 
@@ -15,14 +15,14 @@ def get_accr_rate(hydro: Hydro, lattice: Lattice, U: ArrayLike, flux: tuple[Arra
     x1_1, x2_1, x1_2, x2_2 = hydro.get_positions(t)
     sink_source = hydro.BH_sink(U, lattice.X1, lattice.X2, x1_1, x2_1) + \
             hydro.BH_sink(U, lattice.X1, lattice.X2, x1_2, x2_2)
-    m_dot = (sink_source[..., 0] * dA)
+    m_dot = (sink_source[0] * dA)
     return jnp.sum(m_dot)
 
 
 @partial(jit, static_argnames=["hydro", "lattice"])
 def get_torque1(hydro: Hydro, lattice: Lattice, U: ArrayLike, flux: tuple[ArrayLike, ArrayLike, ArrayLike, ArrayLike], t: float) -> float:
     x1_1, x2_1, x1_2, x2_2 = hydro.get_positions(t)
-    rho = U[..., 0]
+    rho = U[0]
     x_bh, y_bh = x1_1, x2_1
     dA = lattice.dX1 * lattice.dX2
 
@@ -41,7 +41,7 @@ def get_torque1(hydro: Hydro, lattice: Lattice, U: ArrayLike, flux: tuple[ArrayL
 @partial(jit, static_argnames=["hydro", "lattice"])
 def get_torque2(hydro: Hydro, lattice: Lattice, U: ArrayLike, flux: tuple[ArrayLike, ArrayLike, ArrayLike, ArrayLike], t: float) -> float:
     x1_1, x2_1, x1_2, x2_2 = hydro.get_positions(t)
-    rho = U[..., 0]
+    rho = U[0]
     x_bh, y_bh = x1_2, x2_2
     dA = lattice.dX1 * lattice.dX2
 
@@ -75,16 +75,6 @@ def get_eccentricity(hydro: Hydro, lattice: Lattice, U: ArrayLike, flux: tuple[A
     return ec_x, ec_y
 
 
-@partial(jit, static_argnames=["hydro", "lattice"])
-def get_eccentricity_x(hydro: Hydro, lattice: Lattice, U: ArrayLike, flux: tuple[ArrayLike, ArrayLike, ArrayLike, ArrayLike], t: float):
-    return get_eccentricity(hydro, lattice, U, flux, t)[0]
-
-
-@partial(jit, static_argnames=["hydro", "lattice"])
-def get_eccentricity_y(hydro: Hydro, lattice: Lattice, U: ArrayLike, flux: tuple[ArrayLike, ArrayLike, ArrayLike, ArrayLike], t: float):
-    return get_eccentricity(hydro, lattice, U, flux, t)[1]
-
-
 @dataclass(frozen=True)
 class Ring(Hydro):
     G: float = 1
@@ -120,7 +110,10 @@ class Ring(Hydro):
             rho * u,
             rho * v,
             self.E((rho, u, v, jnp.zeros_like(rho)), X1, X2, t)
-        ]).transpose((1, 2, 0))
+        ])
+
+    def variables_first(self) -> bool:
+        return True
 
     def range(self) -> tuple[tuple[float, float], tuple[float, float]]:
         return ((-self.domain_size, self.domain_size), (-self.domain_size, self.domain_size))
@@ -149,13 +142,21 @@ class Ring(Hydro):
     def nu(self) -> float:
         return 1e-3 * (self.a ** 2) * self.omega_B
 
-    def E(self, prims: Primitives, X1: ArrayLike, X2: ArrayLike, t: float) -> Array:
+    def cached_fields(self, X1: ArrayLike, X2: ArrayLike, t: float) -> dict[str, Array]:
+        return {"c_s": self._c_s_field(X1, X2, t)}
+
+    def E(self, prims: Primitives, X1: ArrayLike, X2: ArrayLike, t: float, fields: dict[str, Array] = None) -> Array:
         rho, u, v, p = prims
-        e_internal = rho * (self.c_s(prims, X1, X2, t) ** 2)
+        e_internal = rho * (self.c_s(prims, X1, X2, t, fields) ** 2)
         e_kinetic = 0.5 * rho * (u ** 2 + v ** 2)
         return e_internal + e_kinetic
 
-    def c_s(self, prims: Primitives, X1: ArrayLike, X2: ArrayLike, t: float) -> Array:
+    def c_s(self, prims: Primitives, X1: ArrayLike, X2: ArrayLike, t: float, fields: dict[str, Array] = None) -> Array:
+        if fields is not None:
+            return fields["c_s"]
+        return self._c_s_field(X1, X2, t)
+
+    def _c_s_field(self, X1: ArrayLike, X2: ArrayLike, t: float) -> Array:
         x1_1, x2_1, x1_2, x2_2 = self.get_positions(t)
         r, theta = cartesian_to_polar(X1, X2)
         r1, theta1 = cartesian_to_polar(x1_1, x2_1)
@@ -170,9 +171,9 @@ class Ring(Hydro):
                        (self.G * (self.M / 2) / jnp.sqrt(dist2 ** 2 + self.eps ** 2))) / (self.mach ** 2))
         return cs
 
-    def P(self, cons: Conservatives, X1: ArrayLike, X2: ArrayLike, t: float) -> Array:
+    def P(self, cons: Conservatives, X1: ArrayLike, X2: ArrayLike, t: float, fields: dict[str, Array] = None) -> Array:
         rho, _, _, _ = cons
-        return rho * self.c_s(cons, X1, X2, t) ** 2
+        return rho * self.c_s(cons, X1, X2, t, fields) ** 2
 
     def BH_gravity(self, U, x, y, x_bh, y_bh):
         dx, dy = x - x_bh, y - y_bh
@@ -180,27 +181,27 @@ class Ring(Hydro):
         
         g_acc = - self.G * (self.M / 2) / (r ** 2 + self.eps ** 2)
         g_x, g_y = g_acc * dx / (r + self.eps), g_acc * dy / (r + self.eps)
-        rho = U[..., 0]
-        u, v = U[..., 1] / rho, U[..., 2] / rho
+        rho = U[0]
+        u, v = U[1] / rho, U[2] / rho
 
         return jnp.array([
             jnp.zeros_like(rho),
             rho * g_x,
             rho * g_y,
             rho * (u * g_x + v * g_y)
-        ]).transpose((1, 2, 0))
+        ])
 
     def BH_sink(self, U, x, y, x_bh, y_bh):
-        rho = U[..., 0]
+        rho = U[0]
         dx, dy = x - x_bh, y - y_bh
         r = jnp.sqrt(dx ** 2 + dy ** 2)
         r_sink = self.eps
         sink = jnp.exp(-((r / r_sink) ** 6)) * (self.t_sink ** -1) * rho
-        S = jnp.zeros_like(U).at[:, :, 0].set(-sink)
+        S = jnp.zeros_like(U).at[0].set(-sink)
 
         return S
 
-    def source(self, U: ArrayLike, X1, X2, t: float) -> Array:
+    def source(self, U: ArrayLike, X1, X2, t: float, fields: dict[str, Array] = None) -> Array:
         S = jnp.zeros_like(U)
         x1_1, x2_1, x1_2, x2_2 = self.get_positions(t)
  
@@ -230,22 +231,21 @@ class Ring(Hydro):
     #     v_theta = jnp.sqrt(self.G * self.M / r)
     #     u_k, v_k = - v_theta * \
     #         jnp.sin(theta), v_theta * jnp.cos(theta)
-    #     rho = U[g:-g, g:-g, 0]
+    #     rho = U[0, g:-g, g:-g]
     #     e = self.E((rho, u_k, v_k, jnp.zeros_like(rho)), x, y, t)
 
-    #     U = U.at[g:-g, g:-g, 1].set(jnp.where(buff, rho * u_k, U[g:-g, g:-g, 1]))
-    #     U = U.at[g:-g, g:-g, 2].set(jnp.where(buff, rho * v_k, U[g:-g, g:-g, 2]))
-    #     U = U.at[g:-g, g:-g, 3].set(jnp.where(buff, e, U[g:-g, g:-g, 3]))
+    #     U = U.at[1, g:-g, g:-g].set(jnp.where(buff, rho * u_k, U[1, g:-g, g:-g]))
+    #     U = U.at[2, g:-g, g:-g].set(jnp.where(buff, rho * v_k, U[2, g:-g, g:-g]))
+    #     U = U.at[3, g:-g, g:-g].set(jnp.where(buff, e, U[3, g:-g, g:-g]))
         
     #     return U
 
     def diagnostics(self):
         diagnostics = []
-        diagnostics.append(("m_dot", get_accr_rate))
-        diagnostics.append(("torque_1", get_torque1))
-        diagnostics.append(("torque_2", get_torque2))
-        diagnostics.append(("e_x", get_eccentricity_x))
-        diagnostics.append(("e_y", get_eccentricity_y))
+        diagnostics.append(Diagnostic("m_dot", get_accr_rate, flux=False))
+        diagnostics.append(Diagnostic("torque_1", get_torque1, flux=False))
+        diagnostics.append(Diagnostic("torque_2", get_torque2, flux=False))
+        diagnostics.append(Diagnostic(("e_x", "e_y"), get_eccentricity, flux=False))
         return diagnostics
 
     def save_interval(self):
@@ -14,13 +14,16 @@ class SedovBlast(Hydro):
         # r, _ = X1, X2
         x, y = X1, X2
         r, _ = cartesian_to_polar(x, y)
-        U = jnp.zeros(shape=(X1.shape[0], X1.shape[1], 4))
+        U = jnp.zeros(shape=(4, X1.shape[0], X1.shape[1]))
         
-        U = U.at[r < radius].set(jnp.array([1, 0, 0, 10]))
-        U = U.at[r >= radius].set(jnp.array([1, 0, 0, self.E((1, 1e-4, 0, 0))]))
+        U = U.at[:, r < radius].set(jnp.array([1, 0, 0, 10])[:, None])
+        U = U.at[:, r >= radius].set(jnp.array([1, 0, 0, self.E((1, 1e-4, 0, 0))])[:, None])
         
         return U
         
+    def variables_first(self) -> bool:
+        return True
+
     def t_end(self) -> float:
         return 10
     
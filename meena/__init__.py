@@ -1,2 +1,2 @@
-from .detail import Hydro, Lattice, Coords, Boundary, Primitives, Conservatives, BoundaryCondition
-from .run import run_config, load_config
\ No newline at end of file
+from .detail import Hydro, Lattice, Coords, Boundary, Primitives, Conservatives, BoundaryCondition, Diagnostic
+from .run import run_config, load_config, build_lattice
\ No newline at end of file
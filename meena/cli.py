@@ -1,11 +1,11 @@
+import os
 import click
-import h5py
-import numpy as np
 import matplotlib.pyplot as plt
 
 from . import run_config, load_config
-from .tools import generate_movie
-from src.common.helpers import plot_grid
+from .tools import generate_movie, profile_config, bench_configs
+from src.common.helpers import plot_grid, image_resolution
+from src.common.snapshot import Snapshot
 
 @click.group()
 def cli():
@@ -30,72 +30,59 @@ class DynamicCommand(click.Command):
 @click.option("--checkpoint", type=click.Path())
 @click.option("--plot", type=click.Choice(["density", "log density", "u", "v", "pressure", "energy"]))
 @click.option("--plot-range", type=(float, float))
+@click.option("--plot-interval", type=float, default=0.5, help="Seconds of wall-clock time between live plot frames.")
+@click.option("--plot-every", type=int, default=None, help="Steps between live plot frames, instead of --plot-interval.")
 @click.option("--output-dir", type=click.Path())
-def run(config_file, checkpoint, plot, plot_range, output_dir, **kwargs):
+@click.option("--resume", is_flag=True, help="Continue from the latest checkpoint in the output directory.")
+def run(config_file, checkpoint, plot, plot_range, plot_interval, plot_every, output_dir, resume, **kwargs):
     ctx = click.get_current_context()
     dynamic_command = ctx.command
     og_kwargs = {}
     for k, v in kwargs.items():
         og_key = dynamic_command.og_params[k.replace("_", "-")]
         og_kwargs[og_key] = v
-    run_config(config_file, checkpoint, plot, plot_range, output_dir, **og_kwargs)
+    run_config(config_file, checkpoint, plot, plot_range, output_dir, resume, plot_interval, plot_every, **og_kwargs)
 
 @click.command()
 @click.argument("checkpoint_file", type=click.Path(exists=True))
-@click.option("-v", "--var", type=click.Choice(["density", "log density", "u", "v", "energy"]), default="density")
+@click.option("-v", "--var", type=click.Choice(["density", "log density", "u", "v", "pressure", "energy"]), default="density")
 @click.option("-r", "--range", type=(float, float, float, float), default=None)
 @click.option("--title", type=str, default="")
 @click.option("--dpi", type=int, default=500)
 @click.option("--cmap", type=str, default="magma")
 @click.option("--c-range", type=(float, float))
-def plot(checkpoint_file, var, range, title, dpi, cmap, c_range):
-    labels = {"density": r"$\rho$", "log density": r"$\log_{10} \Sigma$", "u": r"$u$", "v": r"$v$", "energy": r"$E$"}
+@click.option("-t", "--time", type=float, default=None, help="Snapshot nearest to this time, for time-series files.")
+def plot(checkpoint_file, var, range, title, dpi, cmap, c_range, time):
+    labels = {"density": r"$\rho$", "log density": r"$\log_{10} \Sigma$", "u": r"$u$", "v": r"$v$", "pressure": r"$P$", "energy": r"$E$"}
     vmin, vmax = None, None
     if c_range:
         vmin, vmax = c_range
     
-    with h5py.File(checkpoint_file, 'r') as f:
-        t = f.attrs["t"]
-        coords = f.attrs["coords"]
-        x1 = f.attrs["x1"]
-        x2 = f.attrs["x2"]
-        rho, momx1, momx2, e = np.array(f["rho"]), np.array(f["momx1"]), np.array(f["momx2"]), np.array(f["E"])
-        
-        if var == "density":
-            matrix = rho
-        elif var == "log density":
-            matrix = np.log10(rho)
-        elif var == "u":
-            matrix = momx1 / rho
-        elif var == "v":
-            matrix = momx2 / rho
-        elif var == "energy":
-            matrix = e
-
-        if range:
-            x1_min, x1_max = range[0], range[1]
-            x2_min, x2_max = range[2], range[3]
-            x1_min_i = np.searchsorted(x1, x1_min, side="left")
-            x1_max_i = np.searchsorted(x1, x1_max, side="right") - 1
-            x2_min_i = np.searchsorted(x2, x2_min, side="left")
-            x2_max_i = np.searchsorted(x2, x2_max, side="right") - 1
-
-            matrix = matrix[x1_min_i:x1_max_i+1, x2_min_i:x2_max_i+1]
-            x1, x2 = x1[(x1 >= x1_min) & (x1 <= x1_max)], x2[(x2 >= x2_min) & (x2 <= x2_max)]
-        
-        fig, ax, c, cb = plot_grid(matrix, labels[var], coords, x1, x2, vmin, vmax, cmap)
-        if title != "":
-            ax.set_title(title + f", t = {t:.2f}")
-        else:
-            ax.set_title(f"t = {t:.2f}")
+    # only the datasets the variable needs are read, only inside the range, and from the
+    # coarsest preview level that still has a cell per pixel
+    with Snapshot(checkpoint_file, time, region=range, resolution=image_resolution(dpi)) as snapshot:
+        t, coords, x1, x2 = snapshot.t, snapshot.coords, snapshot.x1, snapshot.x2
+        try:
+            matrix = snapshot[var]
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint="'-v' / '--var'")
+    
+    fig, ax, c, cb = plot_grid(matrix, labels[var], coords, x1, x2, vmin, vmax, cmap)
+    if title != "":
+        ax.set_title(title + f", t = {t:.2f}")
+    else:
+        ax.set_title(f"t = {t:.2f}")
+    if "checkpoints/" in checkpoint_file:
         PATH = checkpoint_file.split("checkpoints/")[0]
-        plt.savefig(f"{PATH}/t={t:.2f}.png", bbox_inches="tight", dpi=dpi)
-        plt.show()
-        
+    else:
+        PATH = os.path.dirname(checkpoint_file) or "."
+    plt.savefig(f"{PATH}/t={t:.2f}.png", bbox_inches="tight", dpi=dpi)
+    plt.show()
+    
 @click.command()
 @click.argument("checkpoint_path", type=click.Path(exists=True))
 @click.option("-t", "--t-range", type=(float, float))
-@click.option("-v", "--var", type=click.Choice(["density", "log density", "u", "v", "energy"]), default="density")
+@click.option("-v", "--var", type=click.Choice(["density", "log density", "u", "v", "pressure", "energy"]), default="density")
 @click.option("-r", "--range", type=(float, float, float, float), default=None)
 @click.option("--title", type=str, default="")
 @click.option("--fps", type=int, default=24)
@@ -111,9 +98,41 @@ def movie(checkpoint_path, t_range, var, range, title, fps, dpi, bitrate, cmap,
         
     generate_movie(checkpoint_path, t_min, t_max, var, range, title, fps, vmin, vmax, dpi, bitrate, cmap)
 
+@click.command(cls=DynamicCommand)
+@click.argument("config_file", type=click.Path(exists=True))
+@click.option("-n", "--steps", type=int, default=100, help="Timesteps to profile, after one that compiles the step.")
+@click.option("--output-dir", type=click.Path(), help="Where the trace and phases.csv are written.")
+@click.option("--diagnostics", is_flag=True, help="Accumulate the config's diagnostics in the profiled steps.")
+def profile(config_file, steps, output_dir, diagnostics, **kwargs):
+    ctx = click.get_current_context()
+    dynamic_command = ctx.command
+    og_kwargs = {}
+    for k, v in kwargs.items():
+        og_key = dynamic_command.og_params[k.replace("_", "-")]
+        og_kwargs[og_key] = v
+    profile_config(config_file, steps, output_dir, diagnostics, **og_kwargs)
+
+@click.command()
+@click.argument("config_files", nargs=-1, required=True, type=click.Path(exists=True))
+@click.option("-r", "--resolution", type=int, multiple=True, default=(128, 256, 512), help="nx1 of each run; nx2 keeps the aspect ratio of the config.")
+@click.option("--solver", type=click.Choice(["hll", "hllc"]), multiple=True, default=("hll", "hllc"))
+@click.option("--plm", type=click.Choice(["off", "on"]), multiple=True, default=("off", "on"))
+@click.option("--viscosity", type=click.Choice(["off", "on"]), multiple=True, default=("off", "on"))
+@click.option("--coords", type=click.Choice(["cartesian", "polar"]), multiple=True, default=("cartesian", "polar"), help="Only run the configs in these coordinates.")
+@click.option("--nu", type=float, default=1e-3, help="Viscosity for configs that have none.")
+@click.option("-n", "--steps", type=int, default=50)
+@click.option("--repeats", type=int, default=3)
+@click.option("--output-dir", type=click.Path(), default="./output/bench")
+@click.option("--diagnostics", type=click.Choice(["off", "on"]), multiple=True, default=("off",), help="Accumulate the config's diagnostics in the timed steps.")
+def bench(config_files, resolution, solver, plm, viscosity, coords, nu, steps, repeats, output_dir, diagnostics):
+    bench_configs(config_files, resolution, solver, tuple(p == "on" for p in plm), tuple(v == "on" for v in viscosity),
+                  coords, nu, steps, repeats, output_dir, tuple(d == "on" for d in diagnostics))
+
 cli.add_command(run)
 cli.add_command(plot)
 cli.add_command(movie)
+cli.add_command(profile)
+cli.add_command(bench)
 
 if __name__ == "__main__":
     cli()
\ No newline at end of file
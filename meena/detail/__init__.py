@@ -1 +1 @@
-from .config import BoundaryCondition, Hydro, Lattice, Coords, Boundary, Primitives, Conservatives
\ No newline at end of file
+from .config import BoundaryCondition, Hydro, Lattice, Coords, Boundary, Primitives, Conservatives, Diagnostic
\ No newline at end of file
@@ -5,6 +5,7 @@ import jax.numpy as jnp
 from jax.typing import ArrayLike
 
 from src.common.helpers import linspace_cells, logspace_cells
+from src.common.diagnostics import Diagnostic
 
 
 class Boundary:
@@ -45,11 +46,67 @@ class Lattice:
         else:
             self.x2, self.x2_intf = linspace_cells(
                 self.x2_min, self.x2_max, num=nx2)
-        self.X1, self.X2 = jnp.meshgrid(self.x1, self.x2, indexing="ij")
-        self.X1_INTF, _ = jnp.meshgrid(self.x1_intf, self.x2, indexing="ij")
-        _, self.X2_INTF = jnp.meshgrid(self.x1, self.x2_intf, indexing="ij")
-        self.dX1 = self.X1_INTF[1:, :] - self.X1_INTF[:-1, :]
-        self.dX2 = self.X2_INTF[:, 1:] - self.X2_INTF[:, :-1]
+        self.dx1 = self.x1_intf[1:] - self.x1_intf[:-1]
+        self.dx2 = self.x2_intf[1:] - self.x2_intf[:-1]
+
+        # cell centres extended into the ghost zones with the spacing of the outermost cells
+        g = num_g
+        x1, x2 = self.x1, self.x2
+        self.x1_g = jnp.concatenate([
+            x1[0] - (x1[1] - x1[0]) * jnp.arange(g, 0, -1), x1, x1[-1] + (x1[-1] - x1[-2]) * jnp.arange(1, g + 1)])
+        self.x2_g = jnp.concatenate([
+            x2[0] - (x2[1] - x2[0]) * jnp.arange(g, 0, -1), x2, x2[-1] + (x2[-1] - x2[-2]) * jnp.arange(1, g + 1)])
+
+        # the geometry is separable, so the factors of one coordinate are stored in 1D and
+        # the 2D arrays below are broadcast from them where they are used
+        if coords == Coords.POLAR:
+            # metric factors of the flux divergence: r_{i-1/2} / (r_i dr_i), r_{i+1/2} / (r_i dr_i)
+            # through the x1 faces and 1 / (r_i dtheta_j) through the x2 faces
+            self.r_face_l = self.x1_intf[:-1] / (self.x1 * self.dx1)
+            self.r_face_r = self.x1_intf[1:] / (self.x1 * self.dx1)
+            self.inv_r = 1 / self.x1
+            self.inv_r_dx2 = self.inv_r[:, None] / self.dx2[None, :]
+            # cell volume r dr dtheta
+            self.vol_x1 = self.x1 * self.dx1
+        else:
+            self.vol_x1 = self.dx1
+        self.vol_x2 = self.dx2
+
+    @property
+    def X1(self) -> Array:
+        return jnp.broadcast_to(self.x1[:, None], (self.nx1, self.nx2))
+
+    @property
+    def X2(self) -> Array:
+        return jnp.broadcast_to(self.x2[None, :], (self.nx1, self.nx2))
+
+    @property
+    def X1_INTF(self) -> Array:
+        return jnp.broadcast_to(self.x1_intf[:, None], (self.nx1 + 1, self.nx2))
+
+    @property
+    def X2_INTF(self) -> Array:
+        return jnp.broadcast_to(self.x2_intf[None, :], (self.nx1, self.nx2 + 1))
+
+    @property
+    def dX1(self) -> Array:
+        return jnp.broadcast_to(self.dx1[:, None], (self.nx1, self.nx2))
+
+    @property
+    def dX2(self) -> Array:
+        return jnp.broadcast_to(self.dx2[None, :], (self.nx1, self.nx2))
+
+    @property
+    def dV(self) -> Array:
+        return self.vol_x1[:, None] * self.vol_x2[None, :]
+
+    @property
+    def X1_G(self) -> Array:
+        return jnp.broadcast_to(self.x1_g[:, None], (self.x1_g.shape[0], self.x2_g.shape[0]))
+
+    @property
+    def X2_G(self) -> Array:
+        return jnp.broadcast_to(self.x2_g[None, :], (self.x1_g.shape[0], self.x2_g.shape[0]))
 
 
 class Hydro(ABC):
@@ -75,9 +132,43 @@ class Hydro(ABC):
     def save_interval(self) -> float:
         return None
 
+    def checkpoint_series(self) -> bool:
+        """
+            Whether to append every snapshot to a single time-series file, snapshots.h5 in the
+            output directory, instead of writing one checkpoint file per snapshot.
+        """
+        return False
+
+    def checkpoint_compression(self) -> str:
+        """
+            Lossless filter for the checkpoint datasets: "gzip", "lzf" or None. With a filter
+            the datasets are chunked in tiles and byte-shuffled before compression; without
+            one they are written contiguously.
+        """
+        return None
+
+    def checkpoint_pyramid(self) -> int:
+        """
+            Number of preview levels stored with each checkpoint. Level k holds the conserved
+            variables averaged over blocks of 2^k x 2^k cells, which the plot and movie
+            commands read instead of the full grid when it is finer than the image.
+        """
+        return 0
+
+    def checkpoint_dtype(self) -> str:
+        # on-disk precision of the conserved variables; the state is float32 unless x64 is enabled
+        return "float64"
+
     def regime(self) -> str:
         return "HD"
 
+    def variables_first(self) -> bool:
+        """
+            Whether initialize, source and check_ghosts use the (4, nx1, nx2) layout the engine works in.
+            Configs returning False use (nx1, nx2, 4) and are transposed at the boundary.
+        """
+        return False
+
     def range(self) -> tuple[tuple[float, float], tuple[float, float]]:
         return ((0, 1), (0, 1))
 
@@ -105,6 +196,9 @@ class Hydro(ABC):
     def timestep(self) -> float:
         return None
 
+    def steps_per_dispatch(self) -> int:
+        return 100
+
     def coords(self) -> str:
         return Coords.CARTESIAN
 
@@ -117,26 +211,56 @@ class Hydro(ABC):
     def gamma(self) -> float:
         return 5/3
 
+    def equation_of_state(self) -> str:
+        """
+            "ideal" for the gamma-law gas of the default E, c_s and P, and "custom" when a config
+            overrides any of them (e.g. a locally isothermal disk). Stored with every checkpoint,
+            since the pressure of a custom equation of state cannot be recovered from the file.
+        """
+        custom = any(getattr(type(self), name) is not getattr(Hydro, name) for name in ("E", "c_s", "P"))
+        return "custom" if custom else "ideal"
+
     def nu(self) -> float:
         return None
 
-    def E(self, prims: Primitives, X1: ArrayLike = None, X2: ArrayLike = None, t: float = None) -> Array:
+    def cached_fields(self, X1: ArrayLike, X2: ArrayLike, t: float) -> dict[str, Array]:
+        """
+            Fields that depend only on position and time (e.g. a locally isothermal sound speed).
+            When non-empty, they are evaluated once per step on the ghosted cell centres and passed
+            to E, c_s, P and source through the fields argument, sliced to the matching cells.
+        """
+        return {}
+
+    def E(self, prims: Primitives, X1: ArrayLike = None, X2: ArrayLike = None, t: float = None, fields: dict[str, Array] = None) -> Array:
         rho, u, v, p = prims
         return (p / (self.gamma() - 1)) + (0.5 * rho * (u ** 2 + v ** 2))
 
-    def c_s(self, prims: Primitives, X1: ArrayLike = None, X2: ArrayLike = None, t: float = None) -> Array:
+    def c_s(self, prims: Primitives, X1: ArrayLike = None, X2: ArrayLike = None, t: float = None, fields: dict[str, Array] = None) -> Array:
         rho, u, v, p = prims
         return jnp.sqrt(self.gamma() * p / rho)
 
-    def P(self, cons: Conservatives, X1: ArrayLike = None, X2: ArrayLike = None, t: float = None) -> Array:
+    def P(self, cons: Conservatives, X1: ArrayLike = None, X2: ArrayLike = None, t: float = None, fields: dict[str, Array] = None) -> Array:
         rho, u, v, e = cons
         return (self.gamma() - 1) * (e - (0.5 * rho * (u ** 2 + v ** 2)))
 
-    def source(self, U: ArrayLike, X1: ArrayLike = None, X2: ArrayLike = None, t: float = None) -> Array:
+    def source(self, U: ArrayLike, X1: ArrayLike = None, X2: ArrayLike = None, t: float = None, fields: dict[str, Array] = None) -> Array:
         return jnp.zeros_like(U)
 
-    def check_U(self, lattice: Lattice, U: ArrayLike, t: float) -> Array:
-        return U
+    def check_ghosts(self, lattice: Lattice, ghosts: tuple[Array, Array, Array, Array], t: float) -> tuple[Array, Array, Array, Array]:
+        """
+            Adjusts the ghost zones after the boundary conditions are applied. ghosts holds the
+            (x1 lower, x1 upper, x2 lower, x2 upper) slabs, num_g cells deep and spanning the
+            interior cells of the other direction. A config that still defines the older
+            check_U(lattice, U, t) has it called on the whole ghosted state after this.
+        """
+        return ghosts
 
     def diagnostics(self):
         return []
+
+    def diagnostics_csv(self) -> bool:
+        """
+            Whether to also export the diagnostics to diagnostics.csv at the end of a run.
+            They are always written to diagnostics.h5.
+        """
+        return True
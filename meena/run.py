@@ -3,7 +3,9 @@ import importlib
 import inspect
 from pathlib import Path
 from .detail import Hydro, Lattice
-from src.common.helpers import load_U
+import click
+import h5py
+from src.common.helpers import load_U, load_run_state, find_restart, to_variables_first
 from src.hydro.main import run
 
 def load_config(config_file):
@@ -19,11 +21,8 @@ def load_config(config_file):
                 return obj
     return None
 
-def run_config(config_file, checkpoint, plot, plot_range, output_dir, **kwargs):
-    config_class = load_config(config_file)
-    hydro = config_class(**kwargs)
-    
-    lattice = Lattice(
+def build_lattice(hydro):
+    return Lattice(
         coords=hydro.coords(),
         bc_x1=hydro.bc_x1(),
         bc_x2=hydro.bc_x2(),
@@ -36,14 +35,29 @@ def run_config(config_file, checkpoint, plot, plot_range, output_dir, **kwargs):
         log_x2=hydro.log_x2()
     )
 
-    if checkpoint:  # user specifies a checkpoint file to run from
-        U, t = load_U(checkpoint)
-    else:
-        U, t = hydro.initialize(
-            lattice.X1, lattice.X2), hydro.t_start()
+def run_config(config_file, checkpoint, plot, plot_range, output_dir, resume=False, plot_interval=0.5, plot_every=None, **kwargs):
+    config_class = load_config(config_file)
+    hydro = config_class(**kwargs)
+    lattice = build_lattice(hydro)
 
     out = output_dir if output_dir else f"./output/{Path(config_file).stem}"
 
+    state = None
+    restart = find_restart(out) if resume else None
+    if resume and restart is None:
+        # starting over would truncate the catalog and time series that were meant to be continued
+        raise click.ClickException(f"--resume found no checkpoint with a run state in {out}")
+    if restart:  # continue from the latest checkpoint that holds the full run state
+        file, t = restart
+        U, t = load_U(file, t)
+        with h5py.File(file, "r") as f:
+            _, state = load_run_state(f)
+    elif checkpoint:  # user specifies a checkpoint file to run from
+        U, t = load_U(checkpoint)
+    else:
+        U, t = to_variables_first(hydro, hydro.initialize(
+            lattice.X1, lattice.X2)), hydro.t_start()
+
     run(
         hydro,
         lattice,
@@ -53,7 +67,13 @@ def run_config(config_file, checkpoint, plot, plot_range, output_dir, **kwargs):
         N=None,
         plot=plot,
         plot_range=plot_range,
+        plot_interval=plot_interval,
+        plot_every=plot_every,
         out=out,
         save_interval=hydro.save_interval(),
-        diagnostics=hydro.diagnostics()
+        checkpoint_series=hydro.checkpoint_series(),
+        diagnostics=hydro.diagnostics(),
+        diagnostics_csv=hydro.diagnostics_csv(),
+        steps_per_dispatch=hydro.steps_per_dispatch(),
+        resume=state
     )
\ No newline at end of file
@@ -1 +1,3 @@
-from .movie import generate_movie
\ No newline at end of file
+from .movie import generate_movie
+from .profile import profile_config
+from .bench import bench_configs
\ No newline at end of file
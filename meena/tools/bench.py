@@ -0,0 +1,149 @@
+import csv
+import itertools
+import json
+import os
+import platform
+import time
+from pathlib import Path
+
+import numpy as np
+import jax
+import jax.numpy as jnp
+import matplotlib.pyplot as plt
+from rich.console import Console
+from rich.table import Table
+
+from ..run import load_config, build_lattice
+from src.common.diagnostics import Diagnostic
+from src.common.helpers import add_ghost_cells, to_variables_first
+from src.hydro.diagnostics import diagnostic_groups, open_windows
+from src.hydro.main import advance, initial_timestep
+
+COLUMNS = ["config", "coords", "nx1", "nx2", "zones", "solver", "PLM", "viscosity", "diagnostics",
+           "steps", "compile_seconds", "seconds", "mzps"]
+
+
+def variant(config_class, resolution, solver, PLM, nu):
+    # the config with the swept methods overridden; its other settings are left as they are
+    overrides = {
+        "resolution": lambda self: resolution,
+        "solver": lambda self: solver,
+        "PLM": lambda self: PLM,
+        "nu": lambda self: nu,
+    }
+    return type(config_class.__name__, (config_class,), overrides)()
+
+
+def measure(hydro, lattice, steps, repeats, diagnostics=False):
+    """
+        Seconds taken by steps timesteps in one dispatch, the median over repeats runs that
+        all start from the initial conditions, so every repeat does the same work. The
+        first dispatch, which compiles the step, is timed separately. The config's
+        diagnostics are only accumulated in the steps if diagnostics is set.
+    """
+    g = lattice.num_g
+    U0 = np.asarray(add_ghost_cells(to_variables_first(hydro, hydro.initialize(lattice.X1, lattice.X2)), g))
+    t = float(hydro.t_start())
+    # no end time, so every run takes the same number of steps
+    T = float("inf")
+    groups = diagnostic_groups(tuple(Diagnostic(*d) for d in hydro.diagnostics())) if diagnostics else ()
+    dt = initial_timestep(hydro, lattice, jnp.asarray(U0), t)
+
+    start = time.perf_counter()
+    U, *_ = advance(hydro, lattice, jnp.asarray(U0), t, dt, T, T, 1, 2, groups, open_windows(groups, t, U0.dtype), steps)
+    U.block_until_ready()
+    compile_seconds = time.perf_counter() - start
+
+    times = []
+    for _ in range(repeats):
+        U, windows = jnp.asarray(U0), open_windows(groups, t, U0.dtype)
+        U.block_until_ready()
+        start = time.perf_counter()
+        U, _, _, n, *_ = advance(hydro, lattice, U, t, dt, T, T, 1, 1 + steps, groups, windows, steps)
+        U.block_until_ready()
+        times.append(time.perf_counter() - start)
+    return int(n) - 1, compile_seconds, float(np.median(times))
+
+
+def environment():
+    device = jax.devices()[0]
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": platform.node(),
+        "processor": platform.processor() or platform.machine(),
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+        "jax": jax.__version__,
+        "backend": jax.default_backend(),
+        "device": device.device_kind,
+        "x64": bool(jax.config.jax_enable_x64),
+    }
+
+
+def bench_configs(config_files, resolutions=(128, 256, 512), solvers=("hll", "hllc"), PLM=(False, True),
+                  viscosity=(False, True), coords=("cartesian", "polar"), nu=1e-3, steps=50, repeats=3,
+                  output_dir="./output/bench", diagnostics=(False,)):
+    """
+        Steady-state throughput of every combination of config, resolution, Riemann solver,
+        PLM, viscosity and diagnostics, in million zone updates per second. resolutions sets
+        nx1, and nx2 keeps the aspect ratio of the config. Coordinates are those of each
+        config, so coords selects which configs are run. Viscosity on uses the config's nu,
+        or nu if the config has none. Diagnostics on accumulates the config's diagnostics
+        every step, which is left out by default so only the hydro update is measured.
+
+        Writes bench.csv, bench.json (with the environment the numbers were measured in) and
+        bench.png (zones against throughput) to output_dir.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    console = Console()
+    rows = []
+    for config_file in config_files:
+        config_class = load_config(config_file)
+        base = config_class()
+        if base.coords() not in coords:
+            continue
+        nx1, nx2 = base.resolution()
+        for res, solver, plm, visc, diag in itertools.product(resolutions, solvers, PLM, viscosity, diagnostics):
+            resolution = (res, max(1, round(res * nx2 / nx1)))
+            hydro = variant(config_class, resolution, solver, plm, (base.nu() or nu) if visc else None)
+            lattice = build_lattice(hydro)
+            n, compile_seconds, seconds = measure(hydro, lattice, steps, repeats, diag)
+            zones = lattice.nx1 * lattice.nx2
+            row = dict(zip(COLUMNS, (Path(config_file).stem, lattice.coords, lattice.nx1, lattice.nx2, zones, solver,
+                                     plm, visc, diag, n, compile_seconds, seconds, zones * n / seconds / 1e6)))
+            rows.append(row)
+            console.print(f"{row['config']} {row['nx1']} x {row['nx2']} {solver} PLM={plm} viscosity={visc} "
+                          f"diagnostics={diag}: {row['mzps']:.2f} mzps (compiled in {compile_seconds:.1f} s)")
+
+    with open(f"{output_dir}/bench.csv", "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+    with open(f"{output_dir}/bench.json", "w") as file:
+        json.dump({"environment": environment(), "steps": steps, "repeats": repeats, "results": rows}, file, indent=4)
+    plot_bench(rows, f"{output_dir}/bench.png")
+
+    table = Table(*COLUMNS[:9], "mzps", title="throughput")
+    for row in rows:
+        table.add_row(*(str(row[c]) for c in COLUMNS[:9]), f"{row['mzps']:.2f}")
+    console.print(table)
+    return rows
+
+
+def plot_bench(rows, filename):
+    fig, ax = plt.subplots()
+    series = {}
+    for row in rows:
+        label = f"{row['config']}, {row['solver']}" + (", PLM" if row["PLM"] else "") + (", viscous" if row["viscosity"] else "")
+        label += ", diagnostics" if row["diagnostics"] else ""
+        series.setdefault(label, []).append((row["zones"], row["mzps"]))
+    for label, points in series.items():
+        zones, mzps = zip(*sorted(points))
+        ax.plot(zones, mzps, marker="o", markersize=3, label=label)
+    ax.set_xscale("log")
+    ax.set_title(f"Resolution vs. Speed ({jax.devices()[0].device_kind})")
+    ax.set_xlabel("number of zones")
+    ax.set_ylabel("million zone updates/second")
+    ax.legend(fontsize="x-small")
+    fig.savefig(filename, bbox_inches="tight", dpi=200)
+    plt.close(fig)
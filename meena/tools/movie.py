@@ -1,4 +1,5 @@
-from src.common.helpers import plot_grid, print_progress_bar
+from src.common.helpers import plot_grid, print_progress_bar, time_range, image_resolution, CheckpointCatalog
+from src.common.snapshot import Snapshot
 import os
 import h5py
 import re
@@ -9,6 +10,10 @@ import matplotlib.animation as animation
 
 
 def get_h5_files_in_range(directory, t_min, t_max):
+    if CheckpointCatalog.exists(directory):
+        return CheckpointCatalog(directory).between(t_min, t_max)
+
+    # directories written before the catalog are listed and their file names parsed
     files_in_range = []
     pattern = re.compile(r'out_(\d*\.?\d*)\.h5')
 
@@ -26,38 +31,43 @@ def get_h5_files_in_range(directory, t_min, t_max):
     return sorted(files_in_range, key=lambda x: float(re.match(pattern, os.path.basename(x)).group(1)))
 
 
+def read_snapshots(checkpoint_path, t_min, t_max, region=None, resolution=None):
+    """
+        Yields a Snapshot for every snapshot with t_min <= t <= t_max, from a directory of
+        checkpoints or from a time-series file, which is opened once for all of them.
+        region and resolution are passed on to every Snapshot.
+    """
+    if os.path.isfile(checkpoint_path):
+        with h5py.File(checkpoint_path, 'r') as f:
+            i_min, i_max = time_range(f["t"][...], t_min, t_max)
+            for i in range(i_min, i_max):
+                yield Snapshot(f, index=i, region=region, resolution=resolution)
+    else:
+        for file_path in get_h5_files_in_range(checkpoint_path, t_min, t_max):
+            with Snapshot(file_path, region=region, resolution=resolution) as snapshot:
+                yield snapshot
+
+
+def count_snapshots(checkpoint_path, t_min, t_max):
+    if os.path.isfile(checkpoint_path):
+        with h5py.File(checkpoint_path, 'r') as f:
+            i_min, i_max = time_range(f["t"][...], t_min, t_max)
+            return i_max - i_min
+    return len(get_h5_files_in_range(checkpoint_path, t_min, t_max))
+
+
 def generate_movie(checkpoint_path, t_min, t_max, var, grid_range, title, fps=24, vmin=None, vmax=None, dpi=200, bitrate=-1, cmap="magma"):
-    file_list = get_h5_files_in_range(checkpoint_path, t_min, t_max)
+    n_frames = count_snapshots(checkpoint_path, t_min, t_max)
     labels = {"density": r"$\rho$", "log density": r"$\log_{10} \Sigma$",
-              "u": r"$u$", "v": r"$v$", "energy": r"$E$"}
-    with h5py.File(file_list[0], 'r') as f:
-        coords = f.attrs["coords"]
-        x1 = f.attrs["x1"]
-        x2 = f.attrs["x2"]
-        t = f.attrs["t"]
-        rho, momx1, momx2, e = np.array(f["rho"]), np.array(
-            f["momx1"]), np.array(f["momx2"]), np.array(f["E"])
-        if var == "density":
-            matrix = rho
-        elif var == "log density":
-            matrix = np.log10(rho)
-        elif var == "u":
-            matrix = momx1 / rho
-        elif var == "v":
-            matrix = momx2 / rho
-        elif var == "energy":
-            matrix = e
-
-        if grid_range:
-            x1_min, x1_max = grid_range[0], grid_range[1]
-            x2_min, x2_max = grid_range[2], grid_range[3]
-            x1_min_i = np.searchsorted(x1, x1_min, side="left")
-            x1_max_i = np.searchsorted(x1, x1_max, side="right") - 1
-            x2_min_i = np.searchsorted(x2, x2_min, side="left")
-            x2_max_i = np.searchsorted(x2, x2_max, side="right") - 1
-
-            matrix = matrix[x1_min_i:x1_max_i+1, x2_min_i:x2_max_i+1]
-            x1, x2 = x1[(x1 >= x1_min) & (x1 <= x1_max)], x2[(x2 >= x2_min) & (x2 <= x2_max)]
+              "u": r"$u$", "v": r"$v$", "pressure": r"$P$", "energy": r"$E$"}
+    # only the datasets the variable needs are read, only inside the range, and from the
+    # coarsest preview level that still has a cell per pixel
+    resolution = image_resolution(dpi)
+    frames = read_snapshots(checkpoint_path, t_min, t_max, grid_range, resolution)
+    snapshot = next(frames)
+    t, coords, x1, x2 = snapshot.t, snapshot.coords, snapshot.x1, snapshot.x2
+    matrix = snapshot[var]
+    frames.close()
 
     fig, ax, c, cb = plot_grid(
         matrix, labels[var], coords, x1, x2, vmin, vmax, cmap)
@@ -67,43 +77,29 @@ def generate_movie(checkpoint_path, t_min, t_max, var, grid_range, title, fps=24
         ax.set_title(f"t = {t:.2f}")
     FFMpegWriter = animation.writers['ffmpeg']
     writer = FFMpegWriter(fps=fps, bitrate=bitrate)
-    PATH = checkpoint_path.split("checkpoints/")[0]
+    if os.path.isfile(checkpoint_path):
+        PATH = os.path.dirname(checkpoint_path) or "."
+    else:
+        PATH = checkpoint_path.split("checkpoints/")[0]
     if not os.path.exists(PATH):
         os.makedirs(PATH)
     cm = writer.saving(fig, f"{PATH}/movie.mp4", dpi)
 
     with cm:
-        for i in range(len(file_list)):
-            file_path = file_list[i]
-            with h5py.File(file_path, 'r') as f:
-                t = f.attrs["t"]
-                rho, momx1, momx2, e = np.array(f["rho"]), np.array(
-                    f["momx1"]), np.array(f["momx2"]), np.array(f["E"])
-                if var == "density":
-                    matrix = rho
-                elif var == "log density":
-                    matrix = np.log10(rho)
-                elif var == "u":
-                    matrix = momx1 / rho
-                elif var == "v":
-                    matrix = momx2 / rho
-                elif var == "energy":
-                    matrix = e
-
-                if grid_range:
-                    matrix = matrix[x1_min_i:x1_max_i+1, x2_min_i:x2_max_i+1]
-                
-                if coords == "polar":
-                    c.set_array(matrix.ravel())
-                elif coords == "cartesian":
-                    c.set_data(np.transpose(matrix))
-                cb.update_normal(c)
-                if title != "":
-                    ax.set_title(title + f", t = {t:.2f}")
-                else:
-                    ax.set_title(f"t = {t:.2f}")
-                fig.canvas.draw()
-                writer.grab_frame()
-
-                print_progress_bar(i, len(file_list),
-                                   suffix="complete", length=25)
+        for i, snapshot in enumerate(read_snapshots(checkpoint_path, t_min, t_max, grid_range, resolution)):
+            t, matrix = snapshot.t, snapshot[var]
+
+            if coords == "polar":
+                c.set_array(matrix.ravel())
+            elif coords == "cartesian":
+                c.set_data(np.transpose(matrix))
+            cb.update_normal(c)
+            if title != "":
+                ax.set_title(title + f", t = {t:.2f}")
+            else:
+                ax.set_title(f"t = {t:.2f}")
+            fig.canvas.draw()
+            writer.grab_frame()
+
+            print_progress_bar(i, n_frames,
+                               suffix="complete", length=25)
@@ -1,4 +1,3 @@
-import h5py
 import os
 import jax.numpy as jnp
 import numpy as np
@@ -7,6 +6,7 @@ import matplotlib.ticker
 import matplotlib.pyplot as plt
 from matplotlib.ticker import AutoMinorLocator
 from src.common.helpers import print_progress_bar, read_csv
+from src.common.snapshot import Snapshot
 plt.rcParams['figure.dpi'] = 300
 plt.rcParams['savefig.dpi'] = 300
 
@@ -70,10 +70,17 @@ def torque(diagnostics, label="", color="black"):
     plt.legend()
 
 
+def accretion_rate(diagnostics):
+    # per-step m_dot, or the mass accreted over each window (m_acc) divided by its length
+    if "m_dot" in diagnostics:
+        return diagnostics["m_dot"]
+    return diagnostics["m_acc"] / diagnostics["dt"]
+
+
 def m_dot(diagnostics, label="", color="black"):
     t = diagnostics["t"] / (2 * np.pi)
     output_t = np.linspace(t[0], t[-1], 500)
-    m_dot = gaussian_smooth(t, diagnostics["m_dot"], output_t, sigma=2, truncate=3.0)
+    m_dot = gaussian_smooth(t, accretion_rate(diagnostics), output_t, sigma=2, truncate=3.0)
     plt.plot(output_t, m_dot, linewidth=1, color=color, label=label)
     plt.ylim(0, 0.005)
     plt.axhline(linewidth=1, color="black")
@@ -86,7 +93,7 @@ def m_dot_lombscargle(diagnostics, label=""):
     t = diagnostics["t"] / (2 * np.pi)
     # frequencies (orbits^-1) for which to compute the periodogram
     w = np.linspace(0.1, 5, 1000)
-    vals = diagnostics["m_dot"]
+    vals = accretion_rate(diagnostics)
     pgram = signal.lombscargle(t, vals, w)
     pgram = pgram / max(pgram)
 
@@ -101,7 +108,7 @@ def m_dot_periodogram(diagnostics, label=""):
     t = diagnostics["t"]
     t_min = 200 * 2 * np.pi
     t_max = 300 * 2 * np.pi
-    m_dot = diagnostics["m_dot"][(t <= t_max) & (t > t_min)]
+    m_dot = accretion_rate(diagnostics)[(t <= t_max) & (t > t_min)]
     dt = diagnostics["dt"][0]
     # Compute the periodogram
     frequencies, power = signal.periodogram(m_dot, 1 / (dt / (2 * np.pi)))
@@ -225,24 +232,20 @@ def cavity_precession_rate(diagnostics, label=""):
     
     omega_B = 1
     
-def radial_density():
+def radial_density(path="./mach_40/checkpoints"):
     R, nu = 1, 1e-3
     t_visc = (R**2) / nu
     ts = np.array([0, 0.5, 1]) * t_visc
     colors = ["black", "darkred", "indianred"]
     labels = [r"$t=0$", r"$t=0.5t_{visc}$", r"$t=t_{visc}$"]
     
+    # path is a checkpoint file, a time-series file or a directory of checkpoints
     for i, t in enumerate(ts):
         sim_t = t * 2 * np.pi
         print(sim_t)
-        file_path = f"./mach_40/checkpoints/out_{sim_t:.2f}.h5"
-        with h5py.File(file_path, "r") as f:
-            x1, x2 = f.attrs["x1"], f.attrs["x2"]
-            t = f.attrs["t"] / (2 * np.pi)
-            rho = f["rho"]
-            
-            sigma_r = np.mean(rho, axis=1)
-            plt.plot(x1, sigma_r, color=colors[i], label=labels[i])
+        with Snapshot(path, sim_t) as snapshot:
+            sigma_r = np.mean(snapshot["rho"], axis=1)
+            plt.plot(snapshot.x1, sigma_r, color=colors[i], label=labels[i])
 
     plt.xlabel("r")
     plt.ylabel(r"$\Sigma_r$")
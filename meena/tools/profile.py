@@ -0,0 +1,122 @@
+import glob
+import gzip
+import json
+import os
+import re
+from pathlib import Path
+
+import numpy as np
+import jax
+import jax.numpy as jnp
+from rich.console import Console
+from rich.table import Table
+
+from ..run import load_config, build_lattice
+from src.common.diagnostics import Diagnostic
+from src.common.helpers import add_ghost_cells, to_variables_first, create_csv_file, append_row_csv
+from src.hydro.diagnostics import diagnostic_groups, open_windows
+from src.hydro.main import advance, initial_timestep
+
+# the named scopes of a step, see src/hydro/main.py:step and src/hydro/flux.py:face_flux
+PHASES = ("boundary", "fields", "primitives", "reconstruction", "riemann", "viscosity",
+          "divergence", "solve", "source", "update", "timestep", "diagnostics")
+
+
+def op_phases(hlo_text):
+    """
+        Maps every instruction of a compiled module to the innermost phase its op_name
+        metadata names, or "other". A fusion is attributed to the op it is rooted at, so
+        work fused across phases is counted towards one of them.
+    """
+    phases = {}
+    for match in re.finditer(r'%([\w.\-]+) = .*?metadata=\{op_name="([^"]*)"', hlo_text):
+        name, op_name = match.groups()
+        scopes = [scope for scope in op_name.split("/") if scope in PHASES]
+        phases[name] = scopes[-1] if scopes else "other"
+    return phases
+
+
+def exclusive_times(events):
+    # the time of every event less the events nested in it on the same thread, in microseconds
+    times = []
+    for _, thread in sorted(group_by_thread(events).items()):
+        stack = []
+        for event in sorted(thread, key=lambda e: (e["ts"], -e["dur"])):
+            while stack and event["ts"] >= stack[-1][0]["ts"] + stack[-1][0]["dur"]:
+                times.append(stack.pop())
+            if stack:
+                stack[-1][1] -= event["dur"]
+            stack.append([event, event["dur"]])
+        times.extend(stack)
+    return [(event, exclusive) for event, exclusive in times]
+
+
+def group_by_thread(events):
+    threads = {}
+    for event in events:
+        threads.setdefault((event.get("pid"), event.get("tid")), []).append(event)
+    return threads
+
+
+def phase_times(trace_file, hlo_text, module="jit_advance"):
+    with gzip.open(trace_file) as file:
+        trace = json.load(file)
+    events = trace["traceEvents"] if isinstance(trace, dict) else trace
+    events = [e for e in events if e.get("ph") == "X" and e.get("args", {}).get("hlo_module") == module]
+    phases = op_phases(hlo_text)
+    times = {phase: 0.0 for phase in (*PHASES, "other")}
+    for event, exclusive in exclusive_times(events):
+        times[phases.get(event["args"]["hlo_op"], "other")] += exclusive * 1e-6
+    return times
+
+
+def profile_config(config_file, steps=100, output_dir=None, diagnostics=False, **kwargs):
+    """
+        Runs steps timesteps of a config in one dispatch under the JAX profiler, after a
+        first dispatch that compiles the step, and writes the trace (for TensorBoard or
+        Perfetto) and phases.csv to output_dir. The time of every kernel in the trace is
+        attributed to the phase of the step it belongs to, and the table is printed. The
+        config's diagnostics are only accumulated in the steps if diagnostics is set.
+    """
+    hydro = load_config(config_file)(**kwargs)
+    lattice = build_lattice(hydro)
+    out = output_dir if output_dir else f"./output/{Path(config_file).stem}/profile"
+    os.makedirs(out, exist_ok=True)
+
+    U = add_ghost_cells(to_variables_first(hydro, hydro.initialize(lattice.X1, lattice.X2)), lattice.num_g)
+    t = float(hydro.t_start())
+    T = float(jnp.asarray(hydro.t_end(), dtype=U.dtype))
+    groups = diagnostic_groups(tuple(Diagnostic(*d) for d in hydro.diagnostics())) if diagnostics else ()
+    windows = open_windows(groups, t, U.dtype)
+    dt = initial_timestep(hydro, lattice, U, t)
+
+    # the same executable runs one step here and every step below
+    hlo_text = advance.lower(hydro, lattice, U, t, dt, T, T, 1, 1 + steps, groups, windows, steps).compile().as_text()
+    U, t, dt, n, _, windows, _ = advance(hydro, lattice, U, t, dt, T, T, 1, 2, groups, windows, steps)
+    t, n = float(t), int(n)
+
+    with jax.profiler.trace(out, create_perfetto_trace=True):
+        U, t_end, _, n_end, _, _, _ = advance(hydro, lattice, U, t, dt, T, T, n, n + steps, groups, windows, steps)
+        U.block_until_ready()
+    n_steps = int(n_end) - n
+
+    trace_file = max(glob.glob(f"{out}/**/perfetto_trace.json.gz", recursive=True), key=os.path.getmtime)
+    times = phase_times(trace_file, hlo_text)
+    total = sum(times.values())
+
+    filename = f"{out}/phases.csv"
+    create_csv_file(filename, ["phase", "seconds", "ms per step", "fraction"])
+    table = Table("phase", "seconds", "ms per step", "fraction",
+                  title=f"{Path(config_file).stem}, {lattice.nx1} x {lattice.nx2}, {n_steps} steps")
+    for phase, seconds in times.items():
+        if seconds == 0:
+            continue
+        row = (phase, seconds, 1e3 * seconds / max(n_steps, 1), seconds / total if total > 0 else np.nan)
+        append_row_csv(filename, row)
+        table.add_row(phase, f"{row[1]:.3f}", f"{row[2]:.3f}", f"{row[3]:.1%}")
+    table.add_row("total", f"{total:.3f}", f"{1e3 * total / max(n_steps, 1):.3f}", "", style="bold")
+
+    console = Console()
+    console.print(table)
+    console.print(f"trace written to {os.path.dirname(trace_file)}")
+    return times
@@ -0,0 +1,185 @@
+import os
+import queue
+import sys
+import threading
+import time
+import traceback
+
+import numpy as np
+import h5py
+
+from .helpers import save_to_h5, save_run_state, grid_hash, RunState, CONSERVED
+
+
+class CheckpointWriter:
+    """
+        Writes checkpoints on a background thread so the simulation keeps running while
+        HDF5 writes. save starts the copy of the state to the host and hands it to the
+        thread through a bounded queue; once maxsize checkpoints are waiting, save blocks
+        until the oldest is on disk, which bounds the host memory held by pending states.
+        Every checkpoint is flushed and fsynced before the next one is written. On close,
+        including when the run fails, the queue is drained before returning, and an error
+        raised by the thread is raised again in the caller; if the run is already failing it
+        is only printed, so the original error is the one that propagates. seconds adds up
+        the time the thread spent writing.
+    """
+
+    def __init__(self, hydro, lattice, store=None, catalog=None, maxsize=2):
+        self.hydro = hydro
+        self.lattice = lattice
+        # with a TimeSeriesStore, snapshots are appended to it instead of written to their own files
+        self.store = store
+        # checkpoint files are added to the catalog once they are on disk
+        self.catalog = catalog
+        self.grid = grid_hash(lattice)
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.error = None
+        self.seconds = 0.0
+        self.thread = threading.Thread(target=self.work, name="checkpoint-writer", daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is None:
+            self.close()
+            return
+        try:
+            self.close()
+        except Exception:
+            print("checkpoint writer failed while the run was stopping on an error:", file=sys.stderr)
+            traceback.print_exc()
+
+    def save(self, filename, t, U, state=None):
+        self.check()
+        # U must not be donated while its copy is pending, so callers pass a fresh array
+        U.copy_to_host_async()
+        self.queue.put((filename, t, U, state))
+
+    def work(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                if self.error is None:
+                    start = time.time()
+                    filename, t, U, state = item
+                    state = host_state(state)
+                    if self.store is not None:
+                        self.store.append(t, np.asarray(U), state)
+                    else:
+                        save_to_h5(filename, t, np.asarray(U), self.hydro, self.lattice, state)
+                        fsync(filename)
+                        if self.catalog is not None:
+                            step = state.step if state is not None else None
+                            self.catalog.append(t, step, os.path.basename(filename), self.grid, CONSERVED)
+                            fsync(self.catalog.filename)
+                    self.seconds += time.time() - start
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def check(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        if self.store is not None:
+            self.store.close()
+        self.check()
+
+
+class TimeSeriesStore:
+    """
+        Appends snapshots to one HDF5 file, with time as the leading axis of every conserved
+        variable and a time index t, so a time range is read with one open and a hyperslab.
+        Each snapshot is one chunk (tiled like the checkpoints if compressed).
+
+        The variables are extended and written before t, and t is only extended once they
+        are flushed, so the length of t counts the complete snapshots. Reopening the file
+        drops anything written past it by an interrupted run, as well as every snapshot at
+        or after t_start, so a restart from an earlier time continues the series in order.
+        The grid must match the one the file was created with.
+    """
+
+    def __init__(self, filename, hydro, lattice, t_start, tile=128):
+        self.filename = filename
+        self.file = h5py.File(filename, "a")
+        f = self.file
+        nx1, nx2 = lattice.nx1, lattice.nx2
+
+        if "t" not in f:
+            f.attrs["coords"] = lattice.coords
+            f.attrs["gamma"] = hydro.gamma()
+            f.attrs["eos"] = hydro.equation_of_state()
+            f.create_dataset("x1", data=lattice.x1, dtype="float64")
+            f.create_dataset("x2", data=lattice.x2, dtype="float64")
+            f.create_dataset("t", shape=(0,), maxshape=(None,), chunks=(1024,), dtype="float64")
+
+            compression = hydro.checkpoint_compression()
+            filters = {}
+            if compression is not None:
+                filters = dict(shuffle=True, compression=compression)
+            chunks = (1, min(tile, nx1), min(tile, nx2)) if compression is not None else (1, nx1, nx2)
+            for name in CONSERVED:
+                f.create_dataset(name, shape=(0, nx1, nx2), maxshape=(None, nx1, nx2), chunks=chunks,
+                                 dtype=hydro.checkpoint_dtype(), **filters)
+        elif f["rho"].shape[1:] != (nx1, nx2) or f.attrs["coords"] != lattice.coords:
+            message = f"{filename} holds a {f['rho'].shape[1:]} {f.attrs['coords']} grid, not {(nx1, nx2)} {lattice.coords}"
+            self.file.close()
+            raise ValueError(message)
+
+        times = f["t"][...]
+        self.resize(int(np.searchsorted(times, t_start, side="left")))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def resize(self, n):
+        for name in (*CONSERVED, "t"):
+            self.file[name].resize(n, axis=0)
+        self.file.flush()
+
+    def append(self, t, U, state=None):
+        f = self.file
+        n = f["t"].shape[0]
+        for i, name in enumerate(CONSERVED):
+            f[name].resize(n + 1, axis=0)
+            f[name][n] = U[i]
+        f.flush()
+        f["t"].resize((n + 1,))
+        f["t"][n] = t
+        if state is not None:
+            save_run_state(f, t, state)
+        f.flush()
+        fsync(self.filename)
+
+    def close(self):
+        if self.file:
+            self.file.close()
+
+
+def host_state(state):
+    # the state is handed over with device scalars and windows, read here off the main thread
+    if state is None:
+        return None
+    windows = tuple(np.asarray(window, dtype="float64") for window in state.windows)
+    return RunState(int(state.step), float(state.dt), float(state.next_checkpoint), windows)
+
+
+def fsync(filename):
+    fd = os.open(filename, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,127 @@
+import csv
+import os
+from typing import Callable, NamedTuple
+
+import numpy as np
+import h5py
+
+
+class Diagnostic(NamedTuple):
+    """
+        A diagnostic registered by Hydro.diagnostics. get_val(hydro, lattice, U, flux, t)
+        returns one scalar, or one scalar per name if name is a tuple of names. Diagnostics
+        with flux set to False receive None instead of the cell fluxes.
+        Plain (name, get_val) tuples are read as diagnostics that need the fluxes.
+
+        By default a row is written every step. With interval set, the values are reduced
+        on device over windows of that length in simulation time and one row is written
+        per window, where reduce is one of
+            "sample":   the value at the start of the window
+            "mean":     the time-weighted mean, sum(value * dt) / window
+            "min":      the smallest value
+            "max":      the largest value
+            "integral": sum(value * dt) over the window
+        The dt column of such a table holds the length of each window. At the end of a run
+        the window still open is written as well, with the shorter length it reached.
+    """
+    name: str | tuple[str, ...]
+    get_val: Callable
+    flux: bool = True
+    interval: float = None
+    reduce: str = "sample"
+
+    def columns(self) -> tuple[str, ...]:
+        return (self.name,) if isinstance(self.name, str) else tuple(self.name)
+
+
+def table_name(interval):
+    # diagnostics written every step live at the root of the file, windowed ones in a group
+    return "/" if interval is None else f"window_{interval:g}"
+
+
+class DiagnosticsWriter:
+    """
+        Appends blocks of diagnostics rows to a columnar HDF5 file. Every table (a group of
+        the file) holds one resizable dataset per column. Blocks arrive as device arrays of
+        shape (rows, columns); the copy of each block to the host is started when it is
+        appended and the block is only written when the next one arrives, so the transfer
+        overlaps the next dispatch.
+        If csv_file is given, every table is exported on close, to csv_file for the root
+        table and to csv_file with the table name appended for the others.
+    """
+
+    def __init__(self, filename, tables, csv_file=None, chunk=4096):
+        self.filename = filename
+        self.tables = tables
+        self.csv_file = csv_file
+        self.pending = {table: [] for table in tables}
+
+        self.file = h5py.File(filename, "a")
+        for table, columns in tables.items():
+            group = self.file.require_group(table)
+            group.attrs["columns"] = columns
+            for name in columns:
+                if name not in group:
+                    group.create_dataset(name, shape=(0,), maxshape=(None,), chunks=(chunk,), dtype="float64")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def truncate(self, table, t):
+        # rows from t on are written again by a run restarted at t
+        group = self.file[table]
+        columns = self.tables[table]
+        n = int(np.searchsorted(group["t"][...], t, side="left"))
+        for name in columns:
+            group[name].resize((min(n, group[name].shape[0]),))
+
+    def append(self, table, rows):
+        if rows.shape[0] == 0:
+            return
+        rows.copy_to_host_async()
+        self.write(table)
+        self.pending[table].append(rows)
+
+    def write(self, table):
+        if len(self.pending[table]) == 0:
+            return
+        rows = np.concatenate([np.asarray(block) for block in self.pending[table]])
+        self.pending[table] = []
+        group = self.file[table]
+        columns = self.tables[table]
+        n = group[columns[0]].shape[0]
+        for i, name in enumerate(columns):
+            dset = group[name]
+            dset.resize((n + rows.shape[0],))
+            dset[n:] = rows[:, i]
+
+    def close(self):
+        for table in self.tables:
+            self.write(table)
+        self.file.close()
+        if self.csv_file:
+            for table in self.tables:
+                if table == "/":
+                    export_csv(self.filename, self.csv_file, table)
+                else:
+                    root, ext = os.path.splitext(self.csv_file)
+                    export_csv(self.filename, f"{root}_{table}{ext}", table)
+
+
+def read_diagnostics(filename, table="/"):
+    with h5py.File(filename, "r") as f:
+        group = f[table]
+        return {name: group[name][...] for name in group.attrs["columns"]}
+
+
+def export_csv(filename, csv_file, table="/"):
+    diagnostics = read_diagnostics(filename, table)
+    columns = list(diagnostics.keys())
+    data = np.stack([diagnostics[name] for name in columns], axis=1)
+    with open(csv_file, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(columns)
+        writer.writerows(data.tolist())
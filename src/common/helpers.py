@@ -1,10 +1,16 @@
+from typing import NamedTuple
+
 from matplotlib.patches import Circle
 import matplotlib.pyplot as plt
+import numpy as np
 import jax.numpy as jnp
+from jax import Array, lax
 from jax.typing import ArrayLike
 import pandas as pd
 import h5py
 import csv
+import hashlib
+import os
 
 
 def linspace_cells(min, max, num):
@@ -21,6 +27,11 @@ def logspace_cells(min, max, num):
     return centers, interfaces
 
 
+def image_resolution(dpi):
+    # pixels across the largest side of a default figure, an upper bound on the cells plot_grid can show
+    return int(max(plt.rcParams["figure.figsize"]) * dpi)
+
+
 def cartesian_to_polar(x, y):
     r = jnp.sqrt(x ** 2 + y ** 2)
     theta = jnp.arctan2(y, x)
@@ -55,21 +66,67 @@ def read_csv(path, compress=False):
     return numpy_arrays
 
 
-def save_to_h5(filename, t, U, hydro, lattice):
-    rho, momx1, momx2, E = U[..., 0], U[..., 1], U[..., 2], U[..., 3]
+CONSERVED = ("rho", "momx1", "momx2", "E")
+
+
+def block_average(a, factor):
+    # mean over factor x factor blocks of the last two axes, dropping any leftover cells
+    n1, n2 = a.shape[-2] // factor, a.shape[-1] // factor
+    a = a[..., :n1 * factor, :n2 * factor]
+    return a.reshape(*a.shape[:-2], n1, factor, n2, factor).mean(axis=(-3, -1))
+
+
+def save_to_h5(filename, t, U, hydro, lattice, state=None, tile=128):
+    rho, momx1, momx2, E = U[0], U[1], U[2], U[3]
+    dtype = hydro.checkpoint_dtype()
+    compression = hydro.checkpoint_compression()
+
+    # tiles of the grid are compressed independently, so a tile can be read without the rest
+    def filters(shape):
+        if compression is None:
+            return {}
+        return dict(chunks=(min(tile, shape[0]), min(tile, shape[1])), shuffle=True, compression=compression)
+
     with h5py.File(filename, "w") as f:
         # metadata
         f.attrs["coords"] = lattice.coords
         f.attrs["gamma"] = hydro.gamma()
-        f.attrs["x1"] = lattice.x1
-        f.attrs["x2"] = lattice.x2
+        f.attrs["eos"] = hydro.equation_of_state()
         f.attrs["t"] = t
+        # coordinates are datasets, attributes are limited to 64 KB
+        f.create_dataset("x1", data=lattice.x1, dtype="float64")
+        f.create_dataset("x2", data=lattice.x2, dtype="float64")
 
         # create h5 datasets for conserved variables
-        f.create_dataset("rho", data=rho, dtype="float64")
-        f.create_dataset("momx1", data=momx1, dtype="float64")
-        f.create_dataset("momx2", data=momx2, dtype="float64")
-        f.create_dataset("E", data=E, dtype="float64")
+        f.create_dataset("rho", data=rho, dtype=dtype, **filters(rho.shape))
+        f.create_dataset("momx1", data=momx1, dtype=dtype, **filters(momx1.shape))
+        f.create_dataset("momx2", data=momx2, dtype=dtype, **filters(momx2.shape))
+        f.create_dataset("E", data=E, dtype=dtype, **filters(E.shape))
+
+        # previews: level k averages the conserved variables over 2^k x 2^k blocks of cells
+        x1, x2, level = np.asarray(lattice.x1), np.asarray(lattice.x2), np.asarray(U)
+        for k in range(1, hydro.checkpoint_pyramid() + 1):
+            if min(level.shape[-2:]) < 2:
+                break
+            level = block_average(level, 2)
+            x1 = x1[:2 * level.shape[-2]].reshape(-1, 2).mean(axis=1)
+            x2 = x2[:2 * level.shape[-1]].reshape(-1, 2).mean(axis=1)
+            group = f.create_group(f"pyramid/{k}")
+            group.create_dataset("x1", data=x1, dtype="float64")
+            group.create_dataset("x2", data=x2, dtype="float64")
+            for name, variable in zip(CONSERVED, level):
+                group.create_dataset(name, data=variable, dtype=dtype, **filters(variable.shape))
+
+        # the rest of the run state, so the run can be resumed from this checkpoint
+        if state is not None:
+            save_run_state(f, t, state)
+
+
+def load_coords(f):
+    # checkpoints written before the coordinates were datasets store them as attributes
+    if "x1" in f:
+        return f["x1"][...], f["x2"][...]
+    return f.attrs["x1"], f.attrs["x2"]
 
 
 def create_csv_file(filename, headers):
@@ -84,19 +141,168 @@ def append_row_csv(filename, row):
         writer.writerow(row)
 
 
-def load_U(file):
-    with h5py.File(file, 'r') as f:
-        t = f.attrs["t"]
-        rho, momx1, momx2, e = f["rho"], f["momx1"], f["momx2"], f["E"]
-
-        U = jnp.array([
-            rho,
-            momx1,
-            momx2,
-            e
-        ]).transpose((1, 2, 0))
-
-        return U, t
+def time_range(times, t_min, t_max):
+    # snapshots are stored in time order, so a time range is a contiguous slice
+    return np.searchsorted(times, t_min, side="left"), np.searchsorted(times, t_max, side="right")
+
+
+def nearest_index(times, t):
+    i = np.searchsorted(times, t)
+    if i == 0:
+        return 0
+    if i == len(times):
+        return len(times) - 1
+    return i - 1 if t - times[i - 1] <= times[i] - t else i
+
+
+def grid_hash(lattice):
+    # identifies the grid a checkpoint was written on
+    h = hashlib.sha1(lattice.coords.encode())
+    h.update(np.asarray(lattice.x1, dtype="float64").tobytes())
+    h.update(np.asarray(lattice.x2, dtype="float64").tobytes())
+    return h.hexdigest()[:16]
+
+
+class CheckpointCatalog:
+    """
+        Index of the checkpoints in a directory, kept in catalog.csv with one row per
+        checkpoint: its time, step, file name, a hash of its grid and the variables it
+        holds. Rows are appended in time order, so the checkpoint nearest to a time and
+        the checkpoints in a time range are found by binary search on the times instead
+        of listing the directory and parsing file names.
+    """
+    headers = ["t", "step", "filename", "grid", "variables"]
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.filename = os.path.join(directory, "catalog.csv")
+        self.rows = []
+        if os.path.exists(self.filename):
+            with open(self.filename, newline='') as file:
+                self.rows = list(csv.DictReader(file))
+        self.times = np.array([float(row["t"]) for row in self.rows])
+
+    @staticmethod
+    def exists(directory):
+        return os.path.exists(os.path.join(directory, "catalog.csv"))
+
+    def path(self, i):
+        return os.path.join(self.directory, self.rows[i]["filename"])
+
+    def truncate(self, t):
+        # a run restarted at t replaces every checkpoint from t on
+        n = np.searchsorted(self.times, t, side="left")
+        self.rows, self.times = self.rows[:n], self.times[:n]
+        create_csv_file(self.filename, self.headers)
+        for row in self.rows:
+            append_row_csv(self.filename, [row[name] for name in self.headers])
+
+    def append(self, t, step, filename, grid, variables=CONSERVED):
+        row = [repr(float(t)), step, filename, grid, " ".join(variables)]
+        if not os.path.exists(self.filename):
+            create_csv_file(self.filename, self.headers)
+        append_row_csv(self.filename, row)
+        self.rows.append(dict(zip(self.headers, map(str, row))))
+        self.times = np.append(self.times, float(t))
+
+    def nearest(self, t=None):
+        # the last checkpoint if t is None
+        if len(self.rows) == 0:
+            raise FileNotFoundError(f"no checkpoints in {self.filename}")
+        return self.path(len(self.rows) - 1 if t is None else nearest_index(self.times, t))
+
+    def between(self, t_min, t_max):
+        i_min, i_max = time_range(self.times, t_min, t_max)
+        return [self.path(i) for i in range(i_min, i_max)]
+
+
+def load_U(file, t=None, dtype=None):
+    """
+        The conserved variables of a checkpoint file, of the snapshot nearest to t in a
+        time-series file, or of the checkpoint nearest to t in a directory with a catalog
+        (the last one if t is None). The datasets are read straight into one variables-first
+        host buffer in the precision of the state, which is moved to the device in a single
+        transfer.
+    """
+    if os.path.isdir(file):
+        file = CheckpointCatalog(file).nearest(t)
+    dtype = jnp.result_type(float) if dtype is None else dtype
+    with h5py.File(file, "r") as f:
+        if f["rho"].ndim == 2:
+            t, source = f.attrs["t"], None
+        else:
+            times = f["t"][...]
+            i = len(times) - 1 if t is None else nearest_index(times, t)
+            t, source = times[i], np.s_[i]
+
+        U = np.empty((len(CONSERVED), *f["rho"].shape[-2:]), dtype=dtype)
+        for k, name in enumerate(CONSERVED):
+            f[name].read_direct(U, source_sel=source, dest_sel=np.s_[k])
+
+    return jnp.asarray(U), t
+
+
+class RunState(NamedTuple):
+    """
+        Everything besides U and t that a run carries from one step to the next: the step
+        counter, the timestep of the next step, the time of the next checkpoint and the open
+        diagnostics windows, each flattened to [t0, elapsed, *accumulators].
+    """
+    step: int
+    dt: float
+    next_checkpoint: float
+    windows: tuple
+
+
+def save_run_state(f, t, state):
+    # t is the time of the snapshot the state belongs to
+    if "run" in f:
+        del f["run"]
+    group = f.create_group("run")
+    group.attrs["t"] = t
+    group.attrs["step"] = state.step
+    group.attrs["dt"] = state.dt
+    group.attrs["next_checkpoint"] = state.next_checkpoint
+    for i, window in enumerate(state.windows):
+        group.create_dataset(f"window_{i}", data=window, dtype="float64")
+
+
+def load_run_state(f):
+    group = f["run"]
+    windows = tuple(group[f"window_{i}"][...] for i in range(len(group)))
+    state = RunState(int(group.attrs["step"]), float(group.attrs["dt"]), float(group.attrs["next_checkpoint"]), windows)
+    return group.attrs["t"], state
+
+
+def find_restart(out):
+    """
+        The latest checkpoint in the output directory out that holds a complete run state,
+        as (file, t), or None. The time-series file and the newest such checkpoint in the
+        catalog of the checkpoint directory are compared, and the later of the two is used.
+    """
+    restarts = []
+    series = os.path.join(out, "snapshots.h5")
+    if os.path.exists(series):
+        try:
+            with h5py.File(series, "r") as f:
+                if "run" in f:
+                    restarts.append((series, f["run"].attrs["t"]))
+        except OSError:
+            pass
+
+    directory = os.path.join(out, "checkpoints")
+    if CheckpointCatalog.exists(directory):
+        catalog = CheckpointCatalog(directory)
+        for i in reversed(range(len(catalog.rows))):
+            try:
+                with h5py.File(catalog.path(i), "r") as f:
+                    if "run" in f:
+                        restarts.append((catalog.path(i), f["run"].attrs["t"]))
+                        break
+            except OSError:
+                # missing or partially written
+                continue
+    return max(restarts, key=lambda restart: restart[1], default=None)
 
 
 def plot_grid(matrix, label, coords, x1, x2, vmin=None, vmax=None, cmap="magma"):
@@ -136,100 +342,155 @@ def cartesian_to_polar(x, y):
     return r, theta
 
 
-def add_ghost_cells(arr, num_g, axis=0):
-    if axis == 0:
-        # add ghost cells to the first coordinate direction
-        return jnp.vstack((jnp.repeat(arr[:1, :, :], num_g, axis), arr, jnp.repeat(
-            arr[-1:, :, :], num_g, axis)))
-    elif axis == 1:
-        # add ghost cells to the second coordinate direction
-        return jnp.hstack((jnp.repeat(arr[:, :1, :], num_g, axis), arr, jnp.repeat(
-            arr[:, -1:, :], num_g, axis)))
+def to_variables_first(hydro, U):
+    # configs written for the (nx1, nx2, 4) layout are converted at the boundary
+    return U if hydro.variables_first() else jnp.moveaxis(U, -1, 0)
+
+
+def to_config_layout(hydro, U):
+    return U if hydro.variables_first() else jnp.moveaxis(U, 0, -1)
+
+
+def add_ghost_cells(U, num_g):
+    # allocate the ghost zones around an interior state; they are filled by fill_ghosts every step
+    g = num_g
+    return jnp.pad(U, ((0, 0), (g, g), (g, g)), mode="edge")
+
+
+def strip_ghost_cells(U, num_g):
+    g = num_g
+    return U[:, g:-g, g:-g]
 
 
-def apply_bcs(lattice, U):
+def ghost_slab(U, bc, g, axis, lower):
+    """
+        Ghost zones on one side of the interior cells of the ghosted array U along the given
+        axis (1: x1, 2: x2), restricted to the interior cells of the other axis.
+    """
+    other = 3 - axis
+    n = U.shape[axis]
+    U = lax.slice_in_dim(U, g, U.shape[other] - g, axis=other)
+    if bc == "reflective":
+        inner = lax.slice_in_dim(U, g, 2*g, axis=axis) if lower else lax.slice_in_dim(U, n - 2*g, n - g, axis=axis)
+        # invert the momentum normal to the boundary (momx1 for x1, momx2 for x2)
+        sign = jnp.ones(U.shape[0], dtype=U.dtype).at[axis].set(-1)
+        return jnp.flip(inner, axis=axis) * sign[:, None, None]
+    elif bc == "periodic":
+        return lax.slice_in_dim(U, n - 2*g, n - g, axis=axis) if lower else lax.slice_in_dim(U, g, 2*g, axis=axis)
+    else:
+        # outflow
+        edge = lax.slice_in_dim(U, g, g + 1, axis=axis) if lower else lax.slice_in_dim(U, n - g - 1, n - g, axis=axis)
+        return jnp.repeat(edge, g, axis=axis)
+
+
+def fill_ghosts(hydro, lattice, U, t):
+    """
+        Fills the ghost zones of the ghosted state U from its interior cells in a single pass:
+        the four boundary slabs are built from the boundary conditions, passed through
+        hydro.check_ghosts and written back. The corner zones are not read by any stencil
+        and are left as allocated.
+    """
     g = lattice.num_g
     bc_x1, bc_x2 = lattice.bc_x1, lattice.bc_x2
-    if bc_x1[0] == "outflow":
-        U = U.at[:g, :, :].set(U[g:(g+1), :, :])
-    elif bc_x1[0] == "reflective":
-        U = U.at[:g, :, :].set(jnp.flip(U[g:(2*g), :, :], axis=0))
-        # invert x1 momentum
-        U = U.at[:g, :, 1].set(-jnp.flip(U[g:(2*g), :, 1], axis=0))
-    elif bc_x1[0] == "periodic":
-        U = U.at[:g, :, :].set(U[(-2*g):(-g), :, :])
-
-    if bc_x1[1] == "outflow":
-        U = U.at[-g:, :, :].set(U[-(g+1):-g, :, :])
-    elif bc_x1[1] == "reflective":
-        U = U.at[-g:, :, :].set(jnp.flip(U[-(2*g):-g, :, :], axis=0))
-        # invert x1 momentum
-        U = U.at[-g:, :, 1].set(-jnp.flip(U[-(2*g):-g, :, 1], axis=0))
-    elif bc_x1[1] == "periodic":
-        U = U.at[-g:, :, :].set(U[g:(2*g), :, :])
-
-    if bc_x2[0] == "outflow":
-        U = U.at[:, :g, :].set(U[:, g:(g+1), :])
-    elif bc_x2[0] == "reflective":
-        U = U.at[:, :g, :].set(jnp.flip(U[:, g:(2*g), :], axis=1))
-        # invert x2 momentum
-        U = U.at[:, :g, 2].set(-jnp.flip(U[:, g:(2*g), 2], axis=1))
-    elif bc_x2[0] == "periodic":
-        U = U.at[:, :g, :].set(U[:, (-2*g):(-g), :])
-
-    if bc_x2[1] == "outflow":
-        U = U.at[:, -g:, :].set(U[:, -(g+1):-g, :])
-    elif bc_x2[1] == "reflective":
-        U = U.at[:, -g:, :].set(jnp.flip(U[:, -(2*g):-g, :], axis=1))
-        # invert x2 momentum
-        U = U.at[:, -g:, 2].set(-jnp.flip(U[:, -(2*g):-g, 2], axis=1))
-    elif bc_x2[1] == "periodic":
-        U = U.at[:, -g:, :].set(U[:, g:(2*g), :])
-
+    ghosts = (
+        ghost_slab(U, bc_x1[0], g, axis=1, lower=True),
+        ghost_slab(U, bc_x1[1], g, axis=1, lower=False),
+        ghost_slab(U, bc_x2[0], g, axis=2, lower=True),
+        ghost_slab(U, bc_x2[1], g, axis=2, lower=False)
+    )
+    ghosts = hydro.check_ghosts(lattice, tuple(to_config_layout(hydro, s) for s in ghosts), t)
+    x1_l, x1_r, x2_l, x2_r = (to_variables_first(hydro, s) for s in ghosts)
+
+    U = U.at[:, :g, g:-g].set(x1_l)
+    U = U.at[:, -g:, g:-g].set(x1_r)
+    U = U.at[:, g:-g, :g].set(x2_l)
+    U = U.at[:, g:-g, -g:].set(x2_r)
+
+    if hasattr(hydro, "check_U"):
+        # configs written before check_ghosts still get the whole ghosted state, as they used to
+        U = to_variables_first(hydro, hydro.check_U(lattice, to_config_layout(hydro, U), t))
     return U
 
 def enthalpy(rho: ArrayLike, p: ArrayLike, e: ArrayLike):
     return (e + p) / rho
 
-def get_prims(hydro, U, X1, X2, t):
-    rho = U[..., 0]
-    u, v = U[..., 1] / rho, U[..., 2] / rho
-    e = U[..., 3]
-    p = hydro.P((rho, u, v, e), X1, X2, t)
+def field_kwargs(fields):
+    # only configs that declare cached_fields take the fields argument
+    return {} if fields is None else {"fields": fields}
+
+
+def slice_fields(fields, idx):
+    if fields is None:
+        return None
+    return {name: value[idx] for name, value in fields.items()}
+
+
+def get_prims(hydro, U, X1, X2, t, fields=None):
+    rho = U[0]
+    u, v = U[1] / rho, U[2] / rho
+    e = U[3]
+    p = hydro.P((rho, u, v, e), X1, X2, t, **field_kwargs(fields))
     return rho, u, v, p
 
 
-def U_from_prim(hydro, prims, X1, X2, t):
-    rho, u, v, _ = prims
-    e = hydro.E(prims, X1, X2, t)
-    return jnp.array([
-        rho,
-        rho * u,
-        rho * v,
-        e
-    ]).transpose((1, 2, 0))
+class State(NamedTuple):
+    """
+        Primitive variables of a cell or reconstructed face state, bundled with the derived
+        quantities the flux builders and Riemann solvers share (total energy, sound speed and
+        specific enthalpy) so that each is evaluated once per state.
+    """
+    rho: Array
+    u: Array
+    v: Array
+    p: Array
+    E: Array
+    c_s: Array
+    H: Array
+
 
+def get_state(hydro, U, X1, X2, t, fields=None) -> State:
+    rho, u, v, p = get_prims(hydro, U, X1, X2, t, fields)
+    e = U[3]
+    c_s = hydro.c_s((rho, u, v, p), X1, X2, t, **field_kwargs(fields))
+    return State(rho, u, v, p, e, c_s, enthalpy(rho, p, e))
 
-def F_from_prim(hydro, prims, X1, X2, t):
+
+def state_from_prim(hydro, prims, X1, X2, t, fields=None) -> State:
     rho, u, v, p = prims
-    e = hydro.E(prims, X1, X2, t)
+    e = hydro.E(prims, X1, X2, t, **field_kwargs(fields))
+    c_s = hydro.c_s(prims, X1, X2, t, **field_kwargs(fields))
+    return State(rho, u, v, p, e, c_s, enthalpy(rho, p, e))
+
+
+def slice_state(W: State, idx) -> State:
+    return State(*(x[idx] for x in W))
+
+
+def U_from_state(W: State) -> Array:
     return jnp.array([
-        rho * u,
-        rho * (u ** 2) + p,
-        rho * u * v,
-        (e + p) * u
-    ]).transpose((1, 2, 0))
+        W.rho,
+        W.rho * W.u,
+        W.rho * W.v,
+        W.E
+    ])
 
 
-def G_from_prim(hydro, prims, X1, X2, t):
-    rho, u, v, p = prims
-    e = hydro.E(prims, X1, X2, t)
+def F_from_state(W: State) -> Array:
+    return jnp.array([
+        W.rho * W.u,
+        W.rho * (W.u ** 2) + W.p,
+        W.rho * W.u * W.v,
+        (W.E + W.p) * W.u
+    ])
+
+
+def G_from_state(W: State) -> Array:
     return jnp.array([
-        rho * v,
-        rho * u * v,
-        rho * (v ** 2) + p,
-        (e + p) * v
-    ]).transpose((1, 2, 0))
+        W.rho * W.v,
+        W.rho * W.u * W.v,
+        W.rho * (W.v ** 2) + W.p,
+        (W.E + W.p) * W.v
+    ])
 
 
 def minmod(x, y, z):
@@ -1,6 +1,8 @@
+from contextlib import contextmanager
+import json
 import time
 
-import jax.numpy as jnp
+import jax
 
 from rich.console import Console
 from rich.theme import Theme
@@ -11,7 +13,20 @@ from rich.progress import Progress, TextColumn, BarColumn, MofNCompleteColumn
 
 
 class Logger(Live):
-    def __init__(self):
+    """
+        Progress panel of a run, redrawn at most refresh_per_second times a second however
+        often update_logs is called, and printed once per log_freq timesteps. All the
+        statistics are kept on the host from the values each dispatch returns, so logging
+        never touches the device.
+
+        The first dispatch includes compiling the step, so its wall time, less the time
+        blocked on I/O before it, is reported as compile time; run makes it a single step so
+        that this is all compiling. Throughput (mzps) and the ETA to t_end (or to step n_end)
+        are measured from its end. Time spent blocked on I/O is added up with io(). The
+        panel is redrawn with the last update when the logger exits, so the final panel is
+        current however recently it was drawn before.
+    """
+    def __init__(self, n_start=1, t_start=0, t_end=None, n_end=None, refresh_per_second=4):
         self.log_freq = 1000
         complete_column = MofNCompleteColumn(
             table_column=Column(justify="left"))
@@ -19,16 +34,30 @@ class Logger(Live):
             bar_width=None, table_column=Column(justify="right"))
         self.progress = Progress(bar_column, complete_column, expand=True)
         self.task = self.progress.add_task("", total=self.log_freq)
-        self.n_start = 1
-        self.min_dt = 1
+        self.n_start = n_start
+        self.run_n = n_start
+        self.t_end = t_end
+        self.n_end = n_end
+        self.min_dt = float("inf")
         self.run_start = time.time()
         self.log_start = time.time()
-        
-        super().__init__(console=Console(theme=Theme({"bar.complete": "red"})), refresh_per_second=4)
-        
+        self.log_n = n_start
+        self.last_refresh = 0
+
+        # steady state starts once the first dispatch returns
+        self.compile_seconds = None
+        self.steady_start, self.steady_n, self.steady_t = self.run_start, n_start, t_start
+        self.n, self.t = n_start, t_start
+        self.last_update = self.run_start
+        self.lattice = None
+        self.io_seconds = 0.0
+
+        super().__init__(console=Console(theme=Theme({"bar.complete": "red"})), refresh_per_second=refresh_per_second)
+
     def panel(self, lattice, n, t):
         elapsed = time.time() - self.log_start
-        mzps = (lattice.nx1 * lattice.nx2 * (n - self.n_start) / elapsed) / 1e6
+        mzps = (lattice.nx1 * lattice.nx2 * (n - self.log_n) / max(elapsed, 1e-9)) / 1e6
+        eta = self.eta(n, t)
 
         left_grid = Table.grid(expand=True)
         left_grid.add_column(ratio=1, justify="left")
@@ -41,6 +70,8 @@ class Logger(Live):
         right_grid.add_row("time elapsed", time.strftime(
             "%H:%M:%S", time.gmtime(elapsed)))
         right_grid.add_row("mzps", f"{mzps:.2e}")
+        if eta is not None:
+            right_grid.add_row("eta", time.strftime("%H:%M:%S", time.gmtime(eta)))
         stats_grid = Table.grid(expand=True, padding=(0, 10))
         stats_grid.add_column(ratio=1, justify="left")
         stats_grid.add_column(ratio=1, justify="right")
@@ -50,12 +81,49 @@ class Logger(Live):
         grid.add_row(stats_grid)
         return Panel(grid, title=f"timesteps {self.n_start}-{self.n_start + (self.log_freq - 1)}", border_style="grey50")
 
-    def update_logs(self, lattice, n, t, dt):
-        self.min_dt = jnp.minimum(self.min_dt, dt)
-        self.update(self.panel(lattice, n, t))
-        self.progress.update(self.task, advance=1)
-        if (n - 1) % self.log_freq == 0:
+    def update_logs(self, lattice, n, t, dt, steps=1):
+        now = time.time()
+        # dt is the smallest timestep of the dispatch, already on the host after one sync
+        self.min_dt = min(self.min_dt, float(dt))
+        self.n, self.t, self.last_update = n, t, now
+        self.lattice = lattice
+        if self.compile_seconds is None:
+            self.compile_seconds = now - self.run_start - self.io_seconds
+            self.steady_start, self.steady_n, self.steady_t = now, n, t
+            self.log_start, self.log_n = now, n
+        self.progress.update(self.task, advance=steps)
+        if n - self.n_start >= self.log_freq:
             self.reset(lattice, n, t)
+        elif now - self.last_refresh >= 1 / self.refresh_per_second:
+            self.update(self.panel(lattice, n, t))
+            self.last_refresh = now
+
+    def __exit__(self, *args):
+        # the last update may have come within the refresh interval of the redraw before it;
+        # right after a reset the printed panel is already current
+        if self.lattice is not None and self.n > self.log_n:
+            self.update(self.panel(self.lattice, self.n, self.t))
+        return super().__exit__(*args)
+
+    @contextmanager
+    def io(self):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.io_seconds += time.time() - start
+
+    def eta(self, n, t):
+        elapsed = time.time() - self.steady_start
+        if self.n_end is not None:
+            done, remaining = n - self.steady_n, self.n_end - n
+        elif self.t_end is not None:
+            done, remaining = t - self.steady_t, self.t_end - t
+        else:
+            return None
+        if done <= 0 or elapsed <= 0:
+            return None
+        return max(remaining, 0) * elapsed / done
 
     def reset_progress(self):
         self.progress.remove_task(self.task)
@@ -66,10 +134,53 @@ class Logger(Live):
         self.n_start = n
         self.reset_progress()
         self.log_start = time.time()
-        self.min_dt = 1
-    
+        self.log_n = n
+        self.last_refresh = self.log_start
+        self.min_dt = float("inf")
+
+    def summary(self, lattice, n, **extra):
+        wall = time.time() - self.run_start
+        steady = self.last_update - self.steady_start
+        steps = n - self.steady_n
+        summary = {
+            "zones": lattice.nx1 * lattice.nx2,
+            "steps": n - self.run_n,
+            "t": self.t,
+            "wall_seconds": wall,
+            "compile_seconds": self.compile_seconds or 0.0,
+            "mzps": (lattice.nx1 * lattice.nx2 * steps / steady) / 1e6 if steps > 0 and steady > 0 else None,
+            "io_seconds": self.io_seconds,
+            **peak_memory(),
+        }
+        summary.update(extra)
+        return summary
+
     def print_summary(self, lattice, n):
-        elapsed = time.time() - self.run_start
-        mzps = (lattice.nx1 * lattice.nx2 * n / elapsed) / 1e6
-        self.console.print(f"[bold]time elapsed[/bold] {time.strftime('%H:%M:%S', time.gmtime(elapsed))}")
-        self.console.print(f"[bold]average speed[/bold] {mzps:.2e} mzps")
\ No newline at end of file
+        summary = self.summary(lattice, n)
+        self.console.print(f"[bold]time elapsed[/bold] {time.strftime('%H:%M:%S', time.gmtime(summary['wall_seconds']))}")
+        self.console.print(f"[bold]compile time[/bold] {summary['compile_seconds']:.2f} s")
+        if summary["mzps"] is not None:
+            self.console.print(f"[bold]average speed[/bold] {summary['mzps']:.2e} mzps")
+        self.console.print(f"[bold]time blocked on I/O[/bold] {summary['io_seconds']:.2f} s")
+
+    def write_summary(self, filename, lattice, n, **extra):
+        with open(filename, "w") as file:
+            json.dump(self.summary(lattice, n, **extra), file, indent=4)
+
+
+def peak_memory():
+    # device statistics are only reported by accelerator backends
+    stats = jax.devices()[0].memory_stats() or {}
+    return {
+        "peak_device_bytes": stats.get("peak_bytes_in_use"),
+        "peak_host_bytes": peak_host_bytes(),
+    }
+
+
+def peak_host_bytes():
+    # resource is Unix-only
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
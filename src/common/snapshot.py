@@ -0,0 +1,111 @@
+import os
+
+import numpy as np
+import h5py
+
+from .helpers import CheckpointCatalog, load_coords, nearest_index, CONSERVED
+
+
+class Snapshot:
+    """
+        Lazy reader for one snapshot: a checkpoint file, the snapshot nearest to t in a
+        time-series file, or the checkpoint nearest to t in a directory with a catalog (the
+        last one if t is None). source can also be an open file, with index selecting the
+        snapshot of a time series, so a series is opened once for many snapshots.
+
+        Fields are read on first access and cached: the conserved variables "rho", "momx1",
+        "momx2" and "E", and the derived fields "density", "log density", "u", "v",
+        "energy" and "pressure" (from the stored gamma, so only for ideal-gas runs; files
+        written with a custom equation of state raise ValueError). Only the datasets a
+        field depends on are read. With region = (x1_min, x1_max, x2_min, x2_max) only the
+        cells inside it are read, and x1 and x2 are the coordinates of those cells.
+
+        With resolution set, the fields are read from the coarsest preview level of a
+        checkpoint (see Hydro.checkpoint_pyramid) that still has at least resolution cells
+        inside the region along each axis, and from the full grid if none does. level is
+        the level read, 0 for the full grid.
+    """
+    def __init__(self, source, t=None, index=None, region=None, resolution=None):
+        if isinstance(source, h5py.File):
+            self.file, self.owner = source, False
+        else:
+            if os.path.isdir(source):
+                source = CheckpointCatalog(source).nearest(t)
+            self.file, self.owner = h5py.File(source, "r"), True
+
+        f = self.file
+        self.coords = f.attrs["coords"]
+        self.gamma = f.attrs["gamma"]
+        # files from before the equation of state was recorded are taken to be ideal gas
+        self.eos = f.attrs.get("eos", "ideal")
+        x1, x2 = load_coords(f)
+        if f["rho"].ndim == 2:
+            self.t, self.index = f.attrs["t"], ()
+        else:
+            times = f["t"][...]
+            if index is None:
+                index = len(times) - 1 if t is None else nearest_index(times, t)
+            self.t, self.index = times[index], (index,)
+
+        self.level, self.group = 0, f
+        s1, s2 = region_slices(x1, x2, region)
+        if resolution and "pyramid" in f:
+            # coarsest first; the levels are only read for their coordinates until one is picked
+            for k in sorted(map(int, f["pyramid"]), reverse=True):
+                group = f[f"pyramid/{k}"]
+                l1, l2 = group["x1"][...], group["x2"][...]
+                r1, r2 = region_slices(l1, l2, region)
+                if min(len(l1[r1]), len(l2[r2])) >= resolution:
+                    self.level, self.group = k, group
+                    x1, x2, s1, s2 = l1, l2, r1, r2
+                    break
+
+        self.region = (s1, s2)
+        self.x1, self.x2 = x1[s1], x2[s2]
+        self.fields = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __getitem__(self, name):
+        if name not in self.fields:
+            self.fields[name] = self.compute(name)
+        return self.fields[name]
+
+    def compute(self, name):
+        if name in CONSERVED:
+            # a hyperslab of the snapshot and region
+            return self.group[name][self.index + self.region]
+        if name == "density":
+            return self["rho"]
+        if name == "log density":
+            return np.log10(self["rho"])
+        if name == "u":
+            return self["momx1"] / self["rho"]
+        if name == "v":
+            return self["momx2"] / self["rho"]
+        if name == "energy":
+            return self["E"]
+        if name == "pressure":
+            if self.eos != "ideal":
+                raise ValueError(f"pressure is not stored and the equation of state of this run is {self.eos}, "
+                                 "not an ideal gas")
+            e_kinetic = 0.5 * self["rho"] * (self["u"] ** 2 + self["v"] ** 2)
+            return (self.gamma - 1) * (self["E"] - e_kinetic)
+        raise KeyError(name)
+
+    def close(self):
+        if self.owner:
+            self.file.close()
+
+
+def region_slices(x1, x2, region):
+    if not region:
+        return slice(None), slice(None)
+    x1_min, x1_max, x2_min, x2_max = region
+    s1 = slice(np.searchsorted(x1, x1_min, side="left"), np.searchsorted(x1, x1_max, side="right"))
+    s2 = slice(np.searchsorted(x2, x2_min, side="left"), np.searchsorted(x2, x2_max, side="right"))
+    return s1, s2
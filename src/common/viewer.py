@@ -0,0 +1,114 @@
+import multiprocessing as mp
+from multiprocessing.shared_memory import SharedMemory
+import time
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+from .helpers import plot_grid
+
+
+class LiveViewer:
+    """
+        Live plot of a run, drawn by a separate process so the simulation never waits on
+        matplotlib. Frames are handed over through a shared memory buffer holding the
+        plotted variable on the interior grid: publish copies a frame in unless the viewer
+        is still copying the previous one out, in which case the frame is dropped. The
+        viewer redraws whenever a new frame has arrived.
+
+        A frame is due every `every` steps if it is set, and otherwise every `interval`
+        seconds of wall-clock time. The viewer exits when the run ends or its window is
+        closed; the run carries on without it.
+    """
+
+    def __init__(self, lattice, label, plot_range=None, interval=0.5, every=None, dtype="float32"):
+        self.interval = interval
+        self.every = every
+        self.last_time = -np.inf
+        self.last_n = 0
+
+        shape = (lattice.nx1, lattice.nx2)
+        self.shm = SharedMemory(create=True, size=int(np.prod(shape)) * np.dtype(dtype).itemsize)
+        self.buffer = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf)
+
+        # spawned rather than forked, since JAX is multithreaded
+        ctx = mp.get_context("spawn")
+        self.lock = ctx.Lock()
+        self.frame = ctx.RawValue("q", 0)
+        self.t = ctx.RawValue("d", 0)
+        self.stop = ctx.Event()
+        self.process = ctx.Process(
+            target=view,
+            args=(self.shm.name, shape, dtype, self.lock, self.frame, self.t, self.stop,
+                  label, lattice.coords, np.asarray(lattice.x1), np.asarray(lattice.x2), plot_range),
+            name="meena-viewer", daemon=True)
+        self.process.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def due(self, n):
+        if self.every is not None:
+            return n - self.last_n >= self.every
+        return time.time() - self.last_time >= self.interval
+
+    def next_step(self):
+        # the last step before the next frame is due, for runs that fuse steps into one dispatch
+        if self.every is None:
+            return None
+        return self.last_n + self.every
+
+    def publish(self, matrix, t, n):
+        self.last_time, self.last_n = time.time(), n
+        if not self.process.is_alive() or not self.lock.acquire(block=False):
+            return
+        try:
+            self.buffer[...] = matrix
+            self.t.value = t
+            self.frame.value += 1
+        finally:
+            self.lock.release()
+
+    def close(self):
+        self.stop.set()
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+        del self.buffer
+        self.shm.close()
+        self.shm.unlink()
+
+
+def view(name, shape, dtype, lock, frame, t, stop, label, coords, x1, x2, plot_range=None):
+    shm = SharedMemory(name=name)
+    buffer = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    fig, seen = None, 0
+    try:
+        while not stop.is_set():
+            if frame.value != seen:
+                with lock:
+                    seen, matrix, t_frame = frame.value, buffer.copy(), t.value
+                vmin, vmax = plot_range if plot_range else (np.min(matrix), np.max(matrix))
+                if fig is None:
+                    fig, ax, c, cb = plot_grid(matrix, label, coords, x1, x2, vmin, vmax)
+                elif coords == "cartesian":
+                    c.set_data(np.transpose(matrix))
+                elif coords == "polar":
+                    c.set_array(matrix.ravel())
+                c.set_clim(vmin=vmin, vmax=vmax)
+                cb.update_normal(c)
+                ax.set_title(f"t = {t_frame:.2f}")
+                fig.canvas.draw_idle()
+
+            if fig is None:
+                time.sleep(0.05)
+            elif not plt.fignum_exists(fig.number):
+                return
+            else:
+                plt.pause(0.05)
+    finally:
+        del buffer
+        shm.close()
@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import jax
+import jax.numpy as jnp
+from jax import lax, Array
+from jax.typing import ArrayLike
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from meena import Hydro, Lattice
+
+from ..common.helpers import strip_ghost_cells, to_config_layout
+from ..common.diagnostics import Diagnostic, table_name
+from .flux import cell_fluxes
+
+Group = tuple[float, tuple[Diagnostic, ...]]
+Window = tuple[Array, Array, Array]
+
+
+def diagnostic_groups(diagnostics: tuple[Diagnostic, ...]) -> tuple[Group, ...]:
+    # diagnostics sharing a window length are accumulated and written together
+    groups = {}
+    for d in diagnostics:
+        groups.setdefault(d.interval, []).append(d)
+    return tuple((interval, tuple(group)) for interval, group in groups.items())
+
+
+def group_tables(groups: tuple[Group, ...]) -> dict[str, list[str]]:
+    tables = {}
+    for interval, group in groups:
+        columns = ["t", "dt"]
+        for d in group:
+            columns.extend(d.columns())
+        tables[table_name(interval)] = columns
+    return tables
+
+
+def reductions(group: tuple[Diagnostic, ...]) -> list[str]:
+    return [d.reduce for d in group for _ in d.columns()]
+
+
+def open_window(group: tuple[Diagnostic, ...], t: float, dtype) -> Window:
+    kinds = reductions(group)
+    acc = jnp.array([jnp.inf if kind == "min" else -jnp.inf if kind == "max" else 0 for kind in kinds], dtype=dtype)
+    return jnp.asarray(t, dtype=dtype), jnp.asarray(0, dtype=dtype), acc
+
+
+def open_windows(groups: tuple[Group, ...], t: float, dtype) -> tuple[Window, ...]:
+    return tuple(open_window(group, t, dtype) for _, group in groups)
+
+
+def flatten_windows(windows: tuple[Window, ...]) -> tuple[Array, ...]:
+    # one [t0, elapsed, *acc] array per window, as stored with a checkpoint
+    return tuple(jnp.concatenate([jnp.stack([t0, elapsed]), acc]) for t0, elapsed, acc in windows)
+
+
+def restore_windows(groups: tuple[Group, ...], flat: tuple[ArrayLike, ...], t: float, dtype) -> tuple[Window, ...]:
+    """
+        The windows saved by flatten_windows. If the diagnostics changed since they were
+        saved, fresh windows are opened at t instead.
+    """
+    sizes = tuple(2 + len(reductions(group)) for _, group in groups)
+    if tuple(len(window) for window in flat) != sizes:
+        return open_windows(groups, t, dtype)
+    return tuple(
+        (jnp.asarray(w[0], dtype=dtype), jnp.asarray(w[1], dtype=dtype), jnp.asarray(w[2:], dtype=dtype))
+        for w in flat
+    )
+
+
+def window_row(group: tuple[Diagnostic, ...], window: Window) -> Array:
+    # the row of a window: its start time, the length it covers and the reduced values
+    t0, elapsed, acc = window
+    mean = jnp.array([kind == "mean" for kind in reductions(group)])
+    return jnp.concatenate([jnp.stack([t0, elapsed]), jnp.where(mean, acc / elapsed, acc)])
+
+
+def evaluate(hydro: Hydro, lattice: Lattice, group: tuple[Diagnostic, ...], U: ArrayLike, F: ArrayLike, G: ArrayLike, t: float) -> Array:
+    """
+        The columns of every diagnostic in the group, evaluated on the ghosted state U before
+        the step. All diagnostics are traced into the one compiled step, so quantities they
+        have in common are computed once. The cell fluxes are only built if a diagnostic
+        declares that it needs them.
+    """
+    U = to_config_layout(hydro, strip_ghost_cells(U, lattice.num_g))
+    flux = None
+    if any(d.flux for d in group):
+        flux = tuple(to_config_layout(hydro, f) for f in cell_fluxes(F, G))
+
+    values = []
+    for d in group:
+        value = d.get_val(hydro, lattice, U, flux if d.flux else None, t)
+        values.extend(value if len(d.columns()) > 1 else [value])
+    return jnp.array(values, dtype=U.dtype)
+
+
+def accumulate(hydro: Hydro, lattice: Lattice, interval: float, group: tuple[Diagnostic, ...], window: Window, rows: Array, k: Array,
+               U: ArrayLike, F: ArrayLike, G: ArrayLike, t: float, dt: float) -> tuple[Window, Array, Array]:
+    """
+        Adds the step of length dt starting at t to the open window of the group. When the
+        window reaches its interval (every step if interval is None), its row (start time,
+        length and reduced values) is written to rows[k], k is advanced and the next window
+        opens where this one ended, so integrals cover every step exactly once.
+    """
+    t0, elapsed, acc = window
+    kinds = reductions(group)
+
+    def is_kind(kind):
+        return jnp.array([k == kind for k in kinds])
+
+    if interval is not None and all(kind == "sample" for kind in kinds):
+        # sampled windows only need their diagnostics at the start of each window
+        value = lax.cond(elapsed == 0, lambda: evaluate(hydro, lattice, group, U, F, G, t), lambda: acc)
+    else:
+        value = evaluate(hydro, lattice, group, U, F, G, t)
+
+    acc = jnp.where(is_kind("min"), jnp.minimum(acc, value),
+                    jnp.where(is_kind("max"), jnp.maximum(acc, value),
+                              jnp.where(is_kind("sample"), jnp.where(elapsed == 0, value, acc), acc + value * dt)))
+    elapsed = elapsed + dt
+
+    done = jnp.asarray(True) if interval is None else elapsed >= interval
+    row = window_row(group, (t0, elapsed, acc))
+    rows = rows.at[k].set(jnp.where(done, row, rows[k]))
+
+    next_window = open_window(group, t0 + elapsed, acc.dtype)
+    window = jax.tree.map(lambda a, b: jnp.where(done, a, b), next_window, (t0, elapsed, acc))
+    return window, rows, k + done
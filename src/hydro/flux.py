@@ -1,8 +1,8 @@
 from functools import partial
 import jax.numpy as jnp
-from jax import vmap, Array, debug
+from jax import vmap, lax, Array, debug, named_scope
 from jax.typing import ArrayLike
-from ..common.helpers import U_from_prim, F_from_prim, G_from_prim, get_prims, add_ghost_cells, apply_bcs, minmod, enthalpy
+from ..common.helpers import State, get_state, state_from_prim, slice_state, slice_fields, U_from_state, F_from_state, G_from_state, add_ghost_cells, fill_ghosts, minmod
 
 
 def lambdas(v: ArrayLike, c_s: ArrayLike) -> tuple[Array, Array]:
@@ -21,75 +21,37 @@ def alphas(v_L: ArrayLike, v_R: ArrayLike, c_s_L: ArrayLike, c_s_R: ArrayLike) -
 
 def hll_flux_x1(F_L: ArrayLike, F_R: ArrayLike,
                 U_L: ArrayLike, U_R: ArrayLike,
-                c_s_L: ArrayLike, c_s_R: ArrayLike) -> Array:
-    rho_L, rho_R = U_L[..., 0], U_R[..., 0]
-    v_L, v_R = U_L[..., 1] / rho_L, U_R[..., 1] / rho_R
+                W_L: State, W_R: State) -> tuple[Array, Array]:
+    a_p, a_m = alphas(W_L.u, W_R.u, W_L.c_s, W_R.c_s)
 
-    a_p, a_m = alphas(v_L, v_R, c_s_L, c_s_R)
-    a_p, a_m = a_p[..., None], a_m[..., None]
+    F = (a_p * F_L + a_m * F_R - (a_p * a_m * (U_R - U_L))) / (a_p + a_m)
+    return F, jnp.maximum(a_p, a_m)
 
-    return (a_p * F_L + a_m * F_R - (a_p * a_m * (U_R - U_L))) / (a_p + a_m)
 
+def hll_flux_x2(G_L: ArrayLike, G_R: ArrayLike, U_L: ArrayLike, U_R: ArrayLike, W_L: State, W_R: State) -> tuple[Array, Array]:
+    a_p, a_m = alphas(W_L.v, W_R.v, W_L.c_s, W_R.c_s)
 
-def hll_flux_x2(F_L: ArrayLike, F_R: ArrayLike, U_L: ArrayLike, U_R: ArrayLike, c_s_L: ArrayLike, c_s_R: ArrayLike) -> Array:
-    rho_L, rho_R = U_L[..., 0], U_R[..., 0]
-    v_L, v_R = U_L[..., 2] / rho_L, U_R[..., 2] / rho_R
+    G = (a_p * G_L + a_m * G_R - (a_p * a_m * (U_R - U_L))) / (a_p + a_m)
+    return G, jnp.maximum(a_p, a_m)
 
-    a_p, a_m = alphas(v_L, v_R, c_s_L, c_s_R)
-    a_p, a_m = a_p[..., None], a_m[..., None]
 
-    return (a_p * F_L + a_m * F_R - (a_p * a_m * (U_R - U_L))) / (a_p + a_m)
-
-
-def F_star_x1(hydro, F_k, S_k, S_M, U_k, X1, X2, t):
-    rho_k, vx_k, vy_k, p_k = get_prims(hydro, U_k, X1, X2, t)
-    E_k = U_k[..., -1]
-    v_k = vx_k
-
-    rho_star = rho_k * (S_k - v_k) / (S_k - S_M)
-    p_star = p_k + rho_k * (v_k - S_k) * (v_k - S_M)
-    momx1_star = rho_k * ((S_k - v_k) / (S_k - S_M)) * S_M
-    momx2_star = rho_k * vy_k * ((S_k - v_k) / (S_k - S_M))
-    E_star = (E_k * (S_k - v_k) - p_k *
-              v_k + p_star * S_M) / (S_k - S_M)
-
-    U_star = jnp.array([rho_star, momx1_star, momx2_star, E_star])
-    U_star = jnp.transpose(U_star, (1, 2, 0))
-    S_k = S_k[..., None]
-    return F_k + S_k * (U_star - U_k)
-
-
-def F_star_x2(hydro, F_k, S_k, S_M, U_k, X1, X2, t):
-    rho_k, vx_k, vy_k, p_k = get_prims(hydro, U_k, X1, X2, t)
-    E_k = U_k[..., -1]
-    v_k = vy_k
-
-    rho_star = rho_k * (S_k - v_k) / (S_k - S_M)
-    p_star = p_k + rho_k * (v_k - S_k) * (v_k - S_M)
-    momx1_star = rho_k * vx_k * ((S_k - v_k) / (S_k - S_M))
-    momx2_star = rho_k * ((S_k - v_k) / (S_k - S_M)) * S_M
-    E_star = (E_k * (S_k - v_k) - p_k *
-              v_k + p_star * S_M) / (S_k - S_M)
-
-    U_star = jnp.array([rho_star, momx1_star, momx2_star, E_star])
-    U_star = jnp.transpose(U_star, (1, 2, 0))
-    S_k = S_k[..., None]
-    return F_k + S_k * (U_star - U_k)
-
-
-def hllc_flux_x1(hydro, F_L: ArrayLike, F_R: ArrayLike, U_L: ArrayLike, U_R: ArrayLike, c_s_L: ArrayLike, c_s_R: ArrayLike, X1_L: ArrayLike, X1_R: ArrayLike, X2_C: ArrayLike, t: float) -> Array:
+def hllc_flux(hydro, F_L: ArrayLike, F_R: ArrayLike, U_L: ArrayLike, U_R: ArrayLike, W_L: State, W_R: State, axis: int) -> tuple[Array, Array]:
     """
             HLLC algorithm adapted from Robert Caddy
             https://robertcaddy.com/posts/HLLC-Algorithm/
+            Only the star state on the upwind side of the contact wave can be selected, so
+            it is built once from that side and the flux is assembled in a single select.
+            axis is the direction normal to the faces (1: x1, 2: x2).
     """
-    rho_L, v_L, _, p_L = get_prims(hydro, U_L, X1_L, X2_C, t)
-    rho_R, v_R, _, p_R = get_prims(hydro, U_R, X1_R, X2_C, t)
-    e_L, e_R = U_L[..., -1], U_R[..., -1]
+    if axis == 1:
+        v_L, v_R, w_L, w_R = W_L.u, W_R.u, W_L.v, W_R.v
+    elif axis == 2:
+        v_L, v_R, w_L, w_R = W_L.v, W_R.v, W_L.u, W_R.u
+    rho_L, p_L, c_s_L = W_L.rho, W_L.p, W_L.c_s
+    rho_R, p_R, c_s_R = W_R.rho, W_R.p, W_R.c_s
 
     R_rho = jnp.sqrt(rho_R / rho_L)
-    H_L = enthalpy(rho_L, p_L, e_L)
-    H_R = enthalpy(rho_R, p_R, e_R)
-    H_t = (H_L + (H_R * R_rho)) / (1 + R_rho)  # H tilde
+    H_t = (W_L.H + (W_R.H * R_rho)) / (1 + R_rho)  # H tilde
     v_t = (v_L + (v_R * R_rho)) / (1 + R_rho)
     c_t = jnp.sqrt((hydro.gamma() - 1) * (H_t - (0.5 * v_t ** 2)))
 
@@ -98,63 +60,32 @@ def hllc_flux_x1(hydro, F_L: ArrayLike, F_R: ArrayLike, U_L: ArrayLike, U_R: Arr
     S_M = (rho_R * v_R * (S_R - v_R) - rho_L * v_L * (S_L - v_L) + p_L - p_R) \
         / (rho_R * (S_R - v_R) - rho_L * (S_L - v_L))
 
-    F = jnp.empty_like(F_L)
-    case_1 = S_L > 0
-    case_2 = (S_L <= 0) & (S_M > 0)
-    case_3 = (S_M <= 0) & (S_R >= 0)
-    case_4 = S_R < 0
-    case_1 = case_1[..., None]
-    case_2 = case_2[..., None]
-    case_3 = case_3[..., None]
-    case_4 = case_4[..., None]
-    F = jnp.where(case_1, F_L, F)
-    F = jnp.where(case_2, F_star_x1(
-        hydro, F_L, S_L, S_M, U_L, X1_L, X2_C, t), F)
-    F = jnp.where(case_3, F_star_x1(
-        hydro, F_R, S_R, S_M, U_R, X1_R, X2_C, t), F)
-    F = jnp.where(case_4, F_R, F)
-
-    return F
-
-
-def hllc_flux_x2(hydro, G_L: ArrayLike, G_R: ArrayLike, U_L: ArrayLike, U_R: ArrayLike, c_s_L: ArrayLike, c_s_R: ArrayLike, X1_C: ArrayLike, X2_L: ArrayLike, X2_R: ArrayLike, t: float) -> Array:
-    """
-            HLLC algorithm adapted from Robert Caddy
-            https://robertcaddy.com/posts/HLLC-Algorithm/
-    """
-    rho_L, _, v_L, p_L = get_prims(hydro, U_L, X1_C, X2_L, t)
-    rho_R, _, v_R, p_R = get_prims(hydro, U_R, X1_C, X2_R, t)
-    e_L, e_R = U_L[..., -1], U_R[..., -1]
+    # upwind side of the contact
+    left = S_M > 0
+    S_k = jnp.where(left, S_L, S_R)
+    rho_k, p_k, E_k = jnp.where(left, rho_L, rho_R), jnp.where(left, p_L, p_R), jnp.where(left, W_L.E, W_R.E)
+    v_k, w_k = jnp.where(left, v_L, v_R), jnp.where(left, w_L, w_R)
+    F_k, U_k = jnp.where(left, F_L, F_R), jnp.where(left, U_L, U_R)
 
-    R_rho = jnp.sqrt(rho_R / rho_L)
-    H_L = enthalpy(rho_L, p_L, e_L)
-    H_R = enthalpy(rho_R, p_R, e_R)
-    H_t = (H_L + (H_R * R_rho)) / (1 + R_rho)  # H tilde
-    v_t = (v_L + (v_R * R_rho)) / (1 + R_rho)
-    c_t = jnp.sqrt((hydro.gamma() - 1) * (H_t - (0.5 * v_t ** 2)))
+    rho_star = rho_k * (S_k - v_k) / (S_k - S_M)
+    p_star = p_k + rho_k * (v_k - S_k) * (v_k - S_M)
+    E_star = (E_k * (S_k - v_k) - p_k * v_k + p_star * S_M) / (S_k - S_M)
+    mom_n, mom_t = rho_star * S_M, rho_star * w_k
+    if axis == 1:
+        U_star = jnp.array([rho_star, mom_n, mom_t, E_star])
+    elif axis == 2:
+        U_star = jnp.array([rho_star, mom_t, mom_n, E_star])
+
+    F = jnp.where(S_L > 0, F_L, jnp.where(S_R < 0, F_R, F_k + S_k * (U_star - U_k)))
+    return F, jnp.maximum(jnp.abs(S_L), jnp.abs(S_R))
+
+
+def hllc_flux_x1(hydro, F_L: ArrayLike, F_R: ArrayLike, U_L: ArrayLike, U_R: ArrayLike, W_L: State, W_R: State) -> tuple[Array, Array]:
+    return hllc_flux(hydro, F_L, F_R, U_L, U_R, W_L, W_R, axis=1)
 
-    S_L = jnp.minimum(v_L - c_s_L, v_t - c_t)
-    S_R = jnp.maximum(v_R + c_s_R, v_t + c_t)
-    S_M = (rho_R * v_R * (S_R - v_R) - rho_L * v_L * (S_L - v_L) + p_L - p_R) \
-        / (rho_R * (S_R - v_R) - rho_L * (S_L - v_L))
 
-    G = jnp.empty_like(G_L)
-    case_1 = S_L > 0
-    case_2 = (S_L <= 0) & (S_M > 0)
-    case_3 = (S_M <= 0) & (S_R >= 0)
-    case_4 = S_R < 0
-    case_1 = case_1[..., None]
-    case_2 = case_2[..., None]
-    case_3 = case_3[..., None]
-    case_4 = case_4[..., None]
-    G = jnp.where(case_1, G_L, G)
-    G = jnp.where(case_2, F_star_x2(
-        hydro, G_L, S_L, S_M, U_L, X1_C, X2_L, t), G)
-    G = jnp.where(case_3, F_star_x2(
-        hydro, G_R, S_R, S_M, U_R, X1_C, X2_R, t), G)
-    G = jnp.where(case_4, G_R, G)
-
-    return G
+def hllc_flux_x2(hydro, G_L: ArrayLike, G_R: ArrayLike, U_L: ArrayLike, U_R: ArrayLike, W_L: State, W_R: State) -> tuple[Array, Array]:
+    return hllc_flux(hydro, G_L, G_R, U_L, U_R, W_L, W_R, axis=2)
 
 
 def finite_difference_x1(lattice, u: ArrayLike, x1_g: ArrayLike, x2_g: ArrayLike) -> Array:
@@ -163,8 +94,7 @@ def finite_difference_x1(lattice, u: ArrayLike, x1_g: ArrayLike, x2_g: ArrayLike
         dx = lattice.x1[1] - lattice.x1[0]
         du = (u[(g):-(g-1), g:-g] - u[(g-1):-(g), g:-g]) / (dx)
     elif lattice.coords == "polar":
-        X1, _ = jnp.meshgrid(x1_g[1:-1], lattice.x2, indexing="ij")
-        dR = jnp.diff(X1, axis=0)
+        dR = jnp.diff(x1_g[1:-1])[:, None]
         du = jnp.diff(u[(g-1):-(g-1), g:-g], axis=0) / dR
     return du
 
@@ -177,242 +107,160 @@ def finite_difference_x2(lattice, u: ArrayLike, x1_g: ArrayLike, x2_g: ArrayLike
         du = (u[g:-g, (g):-(g-1)] - u[g:-g, (g-1):-(g)]) / (dy)
     elif lattice.coords == "polar":
         dtheta = lattice.x2[1] - lattice.x2[0]
-        X1, _ = jnp.meshgrid(lattice.x1, lattice.x2_intf, indexing="ij")
-        du = jnp.diff(u[g:-g, (g-1):-(g-1)], axis=1) / (X1 * dtheta)
+        du = jnp.diff(u[g:-g, (g-1):-(g-1)], axis=1) / (lattice.x1[:, None] * dtheta)
     return du
 
 
-def viscosity(hydro, lattice, U: ArrayLike, x1_g: ArrayLike, x2_g: ArrayLike) -> tuple[Array, Array, Array, Array]:
+def viscosity(hydro, lattice, W: State, x1_g: ArrayLike, x2_g: ArrayLike) -> tuple[Array, Array]:
     g = lattice.num_g
-    rho = U[..., 0]
-    u, v = U[..., 1] / rho, U[..., 2] / rho
+    n1, n2 = W.rho.shape
+    rho, u, v = W.rho, W.u, W.v
     dudx = finite_difference_x1(lattice, u, x1_g, x2_g)
     dudy = finite_difference_x2(lattice, u, x1_g, x2_g)
     dvdx = finite_difference_x1(lattice, v, x1_g, x2_g)
     dvdy = finite_difference_x2(lattice, v, x1_g, x2_g)
 
-    zero = jnp.zeros((lattice.nx1, lattice.nx2))
-
-    rho_l = (rho[(g-1):-(g+1), g:-g] + rho[g:-g, g:-g]) / 2
-    rho_r = (rho[g:-g, g:-g] + rho[(g+1):-(g-1), g:-g]) / 2
-    Fv_l = -hydro.nu() * jnp.array([
+    # density averaged onto the x1 faces
+    rho_f = (rho[(g-1):(n1-g), g:-g] + rho[g:(n1-g+1), g:-g]) / 2
+    zero = jnp.zeros_like(rho_f)
+    Fv = -hydro.nu() * jnp.array([
         zero,
-        rho_l * dudx[:-1, :],
-        rho_l * dvdx[:-1, :],
+        rho_f * dudx,
+        rho_f * dvdx,
         zero
-    ]).transpose((1, 2, 0))
+    ])
 
-    Fv_r = -hydro.nu() * jnp.array([
+    # density averaged onto the x2 faces
+    rho_f = (rho[g:-g, (g-1):(n2-g)] + rho[g:-g, g:(n2-g+1)]) / 2
+    zero = jnp.zeros_like(rho_f)
+    Gv = -hydro.nu() * jnp.array([
         zero,
-        rho_r * dudx[1:, :],
-        rho_r * dvdx[1:, :],
+        rho_f * dudy,
+        rho_f * dvdy,
         zero
-    ]).transpose((1, 2, 0))
+    ])
 
-    rho_l = (rho[g:-g, (g-1):-(g+1)] + rho[g:-g, g:-g]) / 2
-    rho_r = (rho[g:-g, g:-g] + rho[g:-g, (g+1):-(g-1)]) / 2
-    Gv_l = -hydro.nu() * jnp.array([
-        zero,
-        rho_l * dudy[:, :-1],
-        rho_l * dvdy[:, :-1],
-        zero
-    ]).transpose((1, 2, 0))
+    return Fv, Gv
 
-    Gv_r = -hydro.nu() * jnp.array([
-        zero,
-        rho_r * dudy[:, 1:],
-        rho_r * dvdy[:, 1:],
-        zero
-    ]).transpose((1, 2, 0))
 
-    return Fv_l, Fv_r, Gv_l, Gv_r
+def plm_faces(prims: ArrayLike, theta: float, g: int, axis: int) -> tuple[Array, Array]:
+    """
+        Left- and right-biased primitive states on every face along the given axis of the
+        ghosted primitive array prims (variables along axis 0). The limited slope of each
+        cell is evaluated once and shared by the two faces that cell borders.
+    """
+    n = prims.shape[axis]
+    dP = jnp.diff(prims, axis=axis)
+    # limited slope of cells 1 ... n-2
+    slope = minmod(theta * lax.slice_in_dim(dP, 0, n - 2, axis=axis),
+                   0.5 * (lax.slice_in_dim(prims, 2, n, axis=axis) - lax.slice_in_dim(prims, 0, n - 2, axis=axis)),
+                   theta * lax.slice_in_dim(dP, 1, n - 1, axis=axis))
+
+    # left-biased state, from the cell to the left of each face
+    prims_l = lax.slice_in_dim(prims, g - 1, n - g, axis=axis) - \
+        0.5 * lax.slice_in_dim(slope, g - 2, n - g - 1, axis=axis)
+    # right-biased state, from the cell to the right of each face
+    prims_r = lax.slice_in_dim(prims, g, n - g + 1, axis=axis) + \
+        0.5 * lax.slice_in_dim(slope, g - 1, n - g, axis=axis)
+    return prims_l, prims_r
+
+
+def riemann_x1(hydro, U_L: ArrayLike, U_R: ArrayLike, W_L: State, W_R: State) -> tuple[Array, Array]:
+    # returns the flux and the fastest signal speed through every face
+    F_L, F_R = F_from_state(W_L), F_from_state(W_R)
+    if hydro.solver() == "hll":
+        return hll_flux_x1(F_L, F_R, U_L, U_R, W_L, W_R)
+    elif hydro.solver() == "hllc":
+        return hllc_flux_x1(hydro, F_L, F_R, U_L, U_R, W_L, W_R)
+
+
+def riemann_x2(hydro, U_L: ArrayLike, U_R: ArrayLike, W_L: State, W_R: State) -> tuple[Array, Array]:
+    G_L, G_R = G_from_state(W_L), G_from_state(W_R)
+    if hydro.solver() == "hll":
+        return hll_flux_x2(G_L, G_R, U_L, U_R, W_L, W_R)
+    elif hydro.solver() == "hllc":
+        return hllc_flux_x2(hydro, G_L, G_R, U_L, U_R, W_L, W_R)
+
+
+def cached_fields(hydro, lattice, t: float) -> dict[str, Array]:
+    """
+        Evaluates the position-dependent fields declared by hydro.cached_fields once on the
+        ghosted cell centres. Returns None if the config declares none.
+    """
+    fields = hydro.cached_fields(lattice.X1_G, lattice.X2_G, t)
+    return fields if fields else None
 
 
-def interface_flux(hydro, lattice, U: ArrayLike, t: float) -> tuple[Array, Array, Array, Array]:
+def face_flux(hydro, lattice, U: ArrayLike, t: float, fields: dict[str, Array] = None) -> tuple[Array, Array, State, tuple[Array, Array]]:
+    """
+        Solves the Riemann problem once on every cell face and returns the face-centred
+        fluxes F with shape (4, nx1 + 1, nx2) and G with shape (4, nx1, nx2 + 1), the state
+        bundle of the interior cells and the fastest signal speeds through the x1 and x2 faces.
+        The flux through the i-1/2 face of cell i is F[:, i] and through the i+1/2 face is F[:, i + 1].
+        U is the ghosted state with its ghost zones already filled by fill_ghosts.
+        fields are the ghosted cached fields, evaluated here if not given.
+    """
     g = lattice.num_g
-    x1, x2 = lattice.x1, lattice.x2
-
-    x1_left = x1[0] - (x1[1] - x1[0]) * jnp.arange(g, 0, -1)
-    x1_right = x1[-1] + (x1[-1] - x1[-2]) * jnp.arange(1, g + 1)
-    x1_g = jnp.concatenate([x1_left, x1, x1_right])
-
-    x2_left = x2[0] - (x2[1] - x2[0]) * jnp.arange(g, 0, -1)
-    x2_right = x2[-1] + (x2[-1] - x2[-2]) * jnp.arange(1, g + 1)
-    x2_g = jnp.concatenate([x2_left, x2, x2_right])
-
-    X1, X2 = jnp.meshgrid(x1_g, x2_g, indexing="ij")
-
-    U = add_ghost_cells(U, g, axis=1)
-    U = add_ghost_cells(U, g, axis=0)
-    U = apply_bcs(lattice, U)
-    U = hydro.check_U(lattice, U, t)
-
-    X1_LL = X1[:-(g+2), g:-g]
-    X1_L = X1[(g-1):-(g+1), g:-g]
-    X1_C = X1[g:-g, g:-g]
-    X1_R = X1[(g+1):-(g-1), g:-g]
-    X1_RR = X1[(g+2):, g:-g]
-    X2_LL = X2[g:-g, :-(g+2)]
-    X2_L = X2[g:-g, (g-1):-(g+1)]
-    X2_C = X2[g:-g, g:-g]
-    X2_R = X2[g:-g, (g+1):-(g-1)]
-    X2_RR = X2[g:-g, (g+2):]
+    X1, X2 = lattice.X1_G, lattice.X2_G
+    if fields is None:
+        fields = cached_fields(hydro, lattice, t)
+
+    # primitives are recovered once on the ghosted array and sliced from there on
+    with named_scope("primitives"):
+        W = get_state(hydro, U, X1, X2, t, fields)
+
+    # cells on either side of every face, indexed along the ghosted axis
+    n1, n2 = U.shape[1], U.shape[2]
+    i_C, j_C = slice(g, n1 - g), slice(g, n2 - g)
+    i_L, i_R = slice(g - 1, n1 - g), slice(g, n1 - g + 1)
+    j_L, j_R = slice(g - 1, n2 - g), slice(g, n2 - g + 1)
 
     if hydro.PLM():
         theta = hydro.theta_PLM()
-
-        prims_C = jnp.asarray(get_prims(hydro, U[g:-g, g:-g], X1_C, X2_C, t))
-        prims_LL = jnp.asarray(
-            get_prims(hydro, U[:-(g+2), g:-g], X1_LL, X2_C, t))
-        prims_L = jnp.asarray(
-            get_prims(hydro, U[(g-1):-(g+1), g:-g], X1_L, X2_C, t))
-        prims_R = jnp.asarray(
-            get_prims(hydro, U[(g+1):-(g-1), g:-g], X1_R, X2_C, t))
-        prims_RR = jnp.asarray(
-            get_prims(hydro, U[(g+2):, g:-g], X1_RR, X2_C, t))
-
-        # left cell interface (i-1/2)
-        # left-biased state
-        prims_ll = prims_L - 0.5 * \
-            minmod(theta * (prims_L - prims_LL), 0.5 *
-                   (prims_C - prims_LL), theta * (prims_C - prims_L))
-        # right-biased state
-        prims_lr = prims_C + 0.5 * \
-            minmod(theta * (prims_C - prims_L), 0.5 *
-                   (prims_R - prims_L), theta * (prims_R - prims_C))
-
-        # right cell interface (i+1/2)
-        # left-biased state
-        prims_rl = prims_C - 0.5 * \
-            minmod(theta * (prims_C - prims_L), 0.5 *
-                   (prims_R - prims_L), theta * (prims_R - prims_C))
-        # right-biased state
-        prims_rr = prims_R + 0.5 * \
-            minmod(theta * (prims_R - prims_C), 0.5 *
-                   (prims_RR - prims_C), theta * (prims_RR - prims_R))
-
-        # maybe for rl and lr i need to use X1_C and X2_C
-        F_ll, F_lr, F_rl, F_rr = F_from_prim(hydro, prims_ll, X1_L, X2_C, t), F_from_prim(
-            hydro, prims_lr, X1_C, X2_C, t), F_from_prim(hydro, prims_rl, X1_C, X2_C, t), F_from_prim(hydro, prims_rr, X1_R, X2_C, t)
-        U_ll, U_lr, U_rl, U_rr = U_from_prim(hydro, prims_ll, X1_L, X2_C, t), U_from_prim(
-            hydro, prims_lr, X1_C, X2_C, t), U_from_prim(hydro, prims_rl, X1_C, X2_C, t), U_from_prim(hydro, prims_rr, X1_R, X2_C, t)
-        c_s_ll, c_s_lr, c_s_rl, c_s_rr = hydro.c_s(prims_ll, X1_L, X2_C, t), hydro.c_s(
-            prims_lr, X1_C, X2_C, t), hydro.c_s(prims_rl, X1_C, X2_C, t), hydro.c_s(prims_rr, X1_R, X2_C, t)
-
-        if hydro.solver() == "hll":
-            F_l, F_r = hll_flux_x1(F_ll, F_lr, U_ll, U_lr, c_s_ll, c_s_lr), hll_flux_x1(
-                F_rl, F_rr, U_rl, U_rr, c_s_rl, c_s_rr)
-        elif hydro.solver() == "hllc":
-            F_l, F_r = hllc_flux_x1(hydro, F_ll, F_lr, U_ll, U_lr, c_s_ll, c_s_lr, X1_L, X1_C, X2_C, t), hllc_flux_x1(hydro,
-                                                                                                                      F_rl, F_rr, U_rl, U_rr, c_s_rl, c_s_rr, X1_C, X1_R, X2_C, t)
-
-        prims_LL = jnp.asarray(
-            get_prims(hydro, U[g:-g, :-(g+2)], X1_C, X2_LL, t))
-        prims_L = jnp.asarray(
-            get_prims(hydro, U[g:-g, (g-1):-(g+1)], X1_C, X2_L, t))
-        prims_R = jnp.asarray(
-            get_prims(hydro, U[g:-g, (g+1):-(g-1)], X1_C, X2_R, t))
-        prims_RR = jnp.asarray(
-            get_prims(hydro, U[g:-g, (g+2):], X1_C, X2_RR, t))
-
-        # left cell interface (i-1/2)
-        # left-biased state
-        prims_ll = prims_L - 0.5 * \
-            minmod(theta * (prims_L - prims_LL), 0.5 *
-                   (prims_C - prims_LL), theta * (prims_C - prims_L))
-        # right-biased state
-        prims_lr = prims_C + 0.5 * \
-            minmod(theta * (prims_C - prims_L), 0.5 *
-                   (prims_R - prims_L), theta * (prims_R - prims_C))
-
-        # right cell interface (i+1/2)
-        # left-biased state
-        prims_rl = prims_C - 0.5 * \
-            minmod(theta * (prims_C - prims_L), 0.5 *
-                   (prims_R - prims_L), theta * (prims_R - prims_C))
-        # right-biased state
-        prims_rr = prims_R + 0.5 * \
-            minmod(theta * (prims_R - prims_C), 0.5 *
-                   (prims_RR - prims_C), theta * (prims_RR - prims_R))
-
-        G_ll, G_lr, G_rl, G_rr = G_from_prim(hydro, prims_ll, X1_C, X2_L, t), G_from_prim(
-            hydro, prims_lr, X1_C, X2_C, t), G_from_prim(hydro, prims_rl, X1_C, X2_C, t), G_from_prim(hydro, prims_rr, X1_C, X2_R, t)
-        U_ll, U_lr, U_rl, U_rr = U_from_prim(hydro, prims_ll, X1_C, X2_L, t), U_from_prim(
-            hydro, prims_lr, X1_C, X2_C, t), U_from_prim(hydro, prims_rl, X1_C, X2_C, t), U_from_prim(hydro, prims_rr, X1_C, X2_R, t)
-        c_s_ll, c_s_lr, c_s_rl, c_s_rr = hydro.c_s(prims_ll, X1_C, X2_L, t), hydro.c_s(
-            prims_lr, X1_C, X2_C, t), hydro.c_s(prims_rl, X1_C, X2_C, t), hydro.c_s(prims_rr, X1_C, X2_R, t)
-
-        if hydro.solver() == "hll":
-            G_l, G_r = hll_flux_x2(G_ll, G_lr, U_ll, U_lr, c_s_ll, c_s_lr), hll_flux_x2(
-                G_rl, G_rr, U_rl, U_rr, c_s_rl, c_s_rr)
-        elif hydro.solver() == "hllc":
-            G_l, G_r = hllc_flux_x2(hydro, G_ll, G_lr, U_ll, U_lr, c_s_ll, c_s_lr, X1_C, X2_L, X2_C, t), hllc_flux_x2(
-                hydro, G_rl, G_rr, U_rl, U_rr, c_s_rl, c_s_rr, X1_C, X2_C, X2_R, t)
+        prims = jnp.asarray((W.rho, W.u, W.v, W.p))
+
+        X1_L, X1_R, X2_C = X1[i_L, j_C], X1[i_R, j_C], X2[i_L, j_C]
+        with named_scope("reconstruction"):
+            prims_l, prims_r = plm_faces(prims[:, :, j_C], theta, g, axis=1)
+            W_l = state_from_prim(hydro, prims_l, X1_L, X2_C, t, slice_fields(fields, (i_L, j_C)))
+            W_r = state_from_prim(hydro, prims_r, X1_R, X2_C, t, slice_fields(fields, (i_R, j_C)))
+        with named_scope("riemann"):
+            F, S1 = riemann_x1(hydro, U_from_state(W_l), U_from_state(W_r), W_l, W_r)
+
+        X1_C, X2_L, X2_R = X1[i_C, j_L], X2[i_C, j_L], X2[i_C, j_R]
+        with named_scope("reconstruction"):
+            prims_l, prims_r = plm_faces(prims[:, i_C, :], theta, g, axis=2)
+            W_l = state_from_prim(hydro, prims_l, X1_C, X2_L, t, slice_fields(fields, (i_C, j_L)))
+            W_r = state_from_prim(hydro, prims_r, X1_C, X2_R, t, slice_fields(fields, (i_C, j_R)))
+        with named_scope("riemann"):
+            G, S2 = riemann_x2(hydro, U_from_state(W_l), U_from_state(W_r), W_l, W_r)
     else:
-        prims = get_prims(hydro, U, X1, X2, t)
-        F = F_from_prim(hydro, prims, X1, X2, t)
-        G = G_from_prim(hydro, prims, X1, X2, t)
-
-        F_L = F[(g-1):-(g+1), g:-g, :]
-        F_C = F[g:-g, g:-g, :]
-        F_R = F[(g+1):-(g-1), g:-g, :]
-        G_L = G[g:-g, (g-1):-(g+1), :]
-        G_C = G[g:-g, g:-g, :]
-        G_R = G[g:-g, (g+1):-(g-1), :]
-        X1_L = X1[(g-1):-(g+1), g:-g]
-        X1_C = X1[g:-g, g:-g]
-        X1_R = X1[(g+1):-(g-1), g:-g]
-        X2_L = X2[g:-g, (g-1):-(g+1)]
-        X2_C = X2[g:-g, g:-g]
-        X2_R = X2[g:-g, (g+1):-(g-1)]
-
-        U_L = U[(g-1):-(g+1), g:-g, :]
-        U_C = U[g:-g, g:-g, :]
-        U_R = U[(g+1):-(g-1), g:-g, :]
-        prims_L = get_prims(hydro, U_L, X1_L, X2_C, t)
-        prims_C = get_prims(hydro, U_C, X1_C, X2_C, t)
-        prims_R = get_prims(hydro, U_R, X1_R, X2_C, t)
-        c_s_L = hydro.c_s(prims_L, X1_L, X2_C, t)
-        c_s_C = hydro.c_s(prims_C, X1_C, X2_C, t)
-        c_s_R = hydro.c_s(prims_R, X1_R, X2_C, t)
-        if hydro.solver() == "hll":
-            # F_(i-1/2)
-            F_l = hll_flux_x1(F_L, F_C, U_L, U_C, c_s_L, c_s_C)
-            # F_(i+1/2)
-            F_r = hll_flux_x1(F_C, F_R, U_C, U_R, c_s_C, c_s_R)
-        elif hydro.solver() == "hllc":
-            F_l = hllc_flux_x1(hydro, F_L, F_C, U_L, U_C,
-                               c_s_L, c_s_C, X1_L, X1_C, X2_C, t)
-            F_r = hllc_flux_x1(hydro, F_C, F_R, U_C, U_R,
-                               c_s_C, c_s_R, X1_C, X1_R, X2_C, t)
-
-        U_L = U[g:-g, (g-1):-(g+1), :]
-        U_C = U[g:-g, g:-g, :]
-        U_R = U[g:-g, (g+1):-(g-1)]
-        prims_L = get_prims(hydro, U_L, X1_C, X2_L, t)
-        prims_C = get_prims(hydro, U_C, X1_C, X2_C, t)
-        prims_R = get_prims(hydro, U_R, X1_C, X2_R, t)
-        c_s_L = hydro.c_s(prims_L, X1_C, X2_L, t)
-        c_s_C = hydro.c_s(prims_C, X1_C, X2_C, t)
-        c_s_R = hydro.c_s(prims_R, X1_C, X2_R, t)
-        if hydro.solver() == "hll":
-            # G_(i-1/2)
-            G_l = hll_flux_x2(G_L, G_C, U_L, U_C, c_s_L, c_s_C)
-            # F_(i+1/2)
-            G_r = hll_flux_x2(G_C, G_R, U_C, U_R, c_s_C, c_s_R)
-        elif hydro.solver() == "hllc":
-            # G_(i-1/2)
-            G_l = hllc_flux_x2(hydro, G_L, G_C, U_L, U_C,
-                               c_s_L, c_s_C, X1_C, X2_L, X2_C, t)
-            # F_(i+1/2)
-            G_r = hllc_flux_x2(hydro, G_C, G_R, U_C, U_R,
-                               c_s_C, c_s_R, X1_C, X2_C, X2_R, t)
+        with named_scope("riemann"):
+            F, S1 = riemann_x1(hydro, U[:, i_L, j_C], U[:, i_R, j_C],
+                               slice_state(W, (i_L, j_C)), slice_state(W, (i_R, j_C)))
+            G, S2 = riemann_x2(hydro, U[:, i_C, j_L], U[:, i_C, j_R],
+                               slice_state(W, (i_C, j_L)), slice_state(W, (i_C, j_R)))
 
     if hydro.nu():
-        Fv_l, Fv_r, Gv_l, Gv_r = viscosity(hydro, lattice, U, x1_g, x2_g)
-        F_l += Fv_l
-        F_r += Fv_r
-        G_l += Gv_l
-        G_r += Gv_r
+        with named_scope("viscosity"):
+            Fv, Gv = viscosity(hydro, lattice, W, lattice.x1_g, lattice.x2_g)
+            F += Fv
+            G += Gv
+
+    return F, G, slice_state(W, (i_C, j_C)), (S1, S2)
 
-    return F_l, F_r, G_l, G_r
+
+def cell_fluxes(F: ArrayLike, G: ArrayLike) -> tuple[Array, Array, Array, Array]:
+    # diagnostics receive the fluxes through the left and right faces of every cell
+    return F[:, :-1, :], F[:, 1:, :], G[:, :, :-1], G[:, :, 1:]
+
+
+def interface_flux(hydro, lattice, U: ArrayLike, t: float) -> tuple[Array, Array, Array, Array]:
+    """
+        Fluxes through the left and right faces of every cell, (F_l, F_r, G_l, G_r).
+        These are views into the face-centred fluxes returned by face_flux.
+        U is the interior state.
+    """
+    U = fill_ghosts(hydro, lattice, add_ghost_cells(U, lattice.num_g), t)
+    F, G, _, _ = face_flux(hydro, lattice, U, t)
+    return cell_fluxes(F, G)
@@ -1,97 +1,186 @@
 from __future__ import annotations
 
+from contextlib import nullcontext
 from functools import partial
+import math
 import os
 
+import numpy as np
 import jax.numpy as jnp
 from jax.typing import ArrayLike
-from jax import jit, Array
-import matplotlib.pyplot as plt
-
+from jax import jit, lax, Array, named_scope
 
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
     from meena import Hydro, Lattice
     
 from ..common.log import Logger
-from ..common.helpers import get_prims, plot_grid, append_row_csv, create_csv_file, save_to_h5
-from .flux import interface_flux
-
-def cartesian_timestep(hydro: Hydro, lattice: Lattice, U: ArrayLike, t: float) -> float:
-    rho, u, v, p = get_prims(hydro, U, lattice.X1, lattice.X2, t)
-    c_s = hydro.c_s((rho, u, v, p), lattice.X1, lattice.X2, t)
-    dt1 = jnp.min(lattice.dX1 / (jnp.abs(u) + c_s))
-    dt2 = jnp.min(lattice.dX2 / (jnp.abs(v) + c_s))
+from ..common.diagnostics import Diagnostic, DiagnosticsWriter, table_name
+from ..common.checkpoints import CheckpointWriter, TimeSeriesStore
+from ..common.viewer import LiveViewer
+from ..common.helpers import get_prims, field_kwargs, slice_fields, to_variables_first, to_config_layout, add_ghost_cells, strip_ghost_cells, fill_ghosts, CheckpointCatalog, RunState
+from .flux import face_flux, cached_fields
+from .diagnostics import diagnostic_groups, group_tables, open_windows, restore_windows, flatten_windows, accumulate, reductions, window_row
+
+def cartesian_timestep(hydro: Hydro, lattice: Lattice, U: ArrayLike, t: float, fields: dict[str, Array] = None) -> float:
+    rho, u, v, p = get_prims(hydro, U, lattice.X1, lattice.X2, t, fields)
+    c_s = hydro.c_s((rho, u, v, p), lattice.X1, lattice.X2, t, **field_kwargs(fields))
+    dt1 = jnp.min(lattice.dx1[:, None] / (jnp.abs(u) + c_s))
+    dt2 = jnp.min(lattice.dx2[None, :] / (jnp.abs(v) + c_s))
     return hydro.cfl() * jnp.minimum(dt1, dt2)
 
 
-def polar_timestep(hydro: Hydro, lattice: Lattice, U: ArrayLike, t: float) -> float:
-    rho, u, v, p = get_prims(hydro, U, lattice.X1, lattice.X2, t)
-    c_s = hydro.c_s((rho, u, v, p), lattice.X1, lattice.X2, t)
-    dt1 = jnp.min(lattice.dX1 / (jnp.abs(u) + c_s))
-    dt2 = jnp.min(lattice.X1 * lattice.dX2 / (jnp.abs(v) + c_s))
+def polar_timestep(hydro: Hydro, lattice: Lattice, U: ArrayLike, t: float, fields: dict[str, Array] = None) -> float:
+    rho, u, v, p = get_prims(hydro, U, lattice.X1, lattice.X2, t, fields)
+    c_s = hydro.c_s((rho, u, v, p), lattice.X1, lattice.X2, t, **field_kwargs(fields))
+    dt1 = jnp.min(lattice.dx1[:, None] / (jnp.abs(u) + c_s))
+    dt2 = jnp.min(lattice.x1[:, None] * lattice.dx2[None, :] / (jnp.abs(v) + c_s))
     return hydro.cfl() * jnp.minimum(dt1, dt2)
 
 
-def compute_timestep(hydro: Hydro, lattice: Lattice, U: ArrayLike, t: float) -> float:
+def compute_timestep(hydro: Hydro, lattice: Lattice, U: ArrayLike, t: float, fields: dict[str, Array] = None) -> float:
     if lattice.coords == "cartesian":
-        return cartesian_timestep(hydro, lattice, U, t)
+        return cartesian_timestep(hydro, lattice, U, t, fields)
     elif lattice.coords == "polar":
-        return polar_timestep(hydro, lattice, U, t)
+        return polar_timestep(hydro, lattice, U, t, fields)
 
 
-def solve_cartesian(hydro: Hydro, lattice: Lattice, U: ArrayLike, t: float) -> tuple[Array, Array, Array, Array]:
-    F_l, F_r, G_l, G_r = interface_flux(hydro, lattice, U, t)
-    L = - ((F_r - F_l) / lattice.dX1[..., jnp.newaxis]) - \
-        ((G_r - G_l) / lattice.dX2[..., jnp.newaxis])
-    flux = F_l, F_r, G_l, G_r
-    return L, flux
-
-
-def solve_polar(hydro: Hydro, lattice: Lattice, U: ArrayLike, t: float) -> tuple[Array, Array, Array, Array]:
-    F_l, F_r, G_l, G_r = interface_flux(hydro, lattice, U, t)
-    rho, u, v, p = get_prims(hydro, U, lattice.X1, lattice.X2, t)
-
-    S = jnp.array([
-        jnp.zeros_like(rho),
-        (p / lattice.X1) + (rho * v ** 2) / lattice.X1,
-        - rho * u * v / lattice.X1,
-        jnp.zeros_like(rho)
-    ]).transpose(1, 2, 0)
-
-    dX1 = lattice.dX1[..., jnp.newaxis]
-    dX2 = lattice.dX2[..., jnp.newaxis]
-    X1_l, X1_r = lattice.X1_INTF[:-1, :,
-                                 jnp.newaxis], lattice.X1_INTF[1:, :, jnp.newaxis]
-    X1 = lattice.X1[..., jnp.newaxis]
-
-    L = - ((X1_r * F_r - X1_l * F_l) / (X1 * dX1)) - \
-        ((G_r - G_l) / (X1 * dX2)) + S
-    flux = F_l, F_r, G_l, G_r
-    return L, flux
-
-
-def solve(hydro: Hydro, lattice: Lattice, U: ArrayLike, t: float) -> tuple[Array, Array, Array, Array]:
+def signal_timestep(hydro: Hydro, lattice: Lattice, speeds: tuple[Array, Array]) -> float:
+    # the fastest signal through either face of a cell bounds its timestep
+    S1, S2 = speeds
+    S1 = jnp.maximum(S1[:-1, :], S1[1:, :])
+    S2 = jnp.maximum(S2[:, :-1], S2[:, 1:])
+    dt1 = jnp.min(lattice.dx1[:, None] / S1)
     if lattice.coords == "cartesian":
-        return solve_cartesian(hydro, lattice, U, t)
+        dt2 = jnp.min(lattice.dx2[None, :] / S2)
     elif lattice.coords == "polar":
-        return solve_polar(hydro, lattice, U, t)
+        dt2 = jnp.min(lattice.x1[:, None] * lattice.dx2[None, :] / S2)
+    return hydro.cfl() * jnp.minimum(dt1, dt2)
 
 
 @partial(jit, static_argnames=["hydro", "lattice"])
-def first_order_step(hydro: Hydro, lattice: Lattice, U: ArrayLike, t: float) -> tuple[Array, float]:
+def initial_timestep(hydro: Hydro, lattice: Lattice, U: ArrayLike, t: float) -> float:
+    """
+        Timestep of the first step, from the cell-centred signal speeds of the ghosted state U.
+        Every later step uses the timestep derived from the wavespeeds of the previous
+        step's Riemann solve, which step returns.
+    """
     if hydro.timestep():
-        dt = hydro.timestep()
-    else:
-        dt = compute_timestep(hydro, lattice, U, t)
-    L, flux = solve(hydro, lattice, U, t)
-    U = U + L * dt + hydro.source(U, lattice.X1, lattice.X2, t) * dt
-    return U, flux, dt
-
-
+        return jnp.asarray(hydro.timestep(), dtype=U.dtype)
+    g = lattice.num_g
+    fields = slice_fields(cached_fields(hydro, lattice, t), (slice(g, -g), slice(g, -g)))
+    return compute_timestep(hydro, lattice, strip_ghost_cells(U, g), t, fields)
+
+
+def solve_cartesian(hydro: Hydro, lattice: Lattice, U: ArrayLike, t: float, fields: dict[str, Array] = None) -> tuple[Array, Array, Array, Array]:
+    F, G, _, speeds = face_flux(hydro, lattice, U, t, fields)
+    with named_scope("divergence"):
+        L = - (jnp.diff(F, axis=1) / lattice.dx1[:, None]) - \
+            (jnp.diff(G, axis=2) / lattice.dx2[None, :])
+    return L, (F, G), speeds
+
+
+def solve_polar(hydro: Hydro, lattice: Lattice, U: ArrayLike, t: float, fields: dict[str, Array] = None) -> tuple[Array, Array, Array, Array]:
+    F, G, W, speeds = face_flux(hydro, lattice, U, t, fields)
+    rho, u, v, p = W.rho, W.u, W.v, W.p
+    # metric factors, the 1D ones broadcast along x2
+    r_face_l, r_face_r = lattice.r_face_l[:, None], lattice.r_face_r[:, None]
+    inv_r, inv_r_dx2 = lattice.inv_r[:, None], lattice.inv_r_dx2
+
+    with named_scope("divergence"):
+        S = jnp.array([
+            jnp.zeros_like(rho),
+            (p + rho * v ** 2) * inv_r,
+            - rho * u * v * inv_r,
+            jnp.zeros_like(rho)
+        ])
+
+        L = - (r_face_r * F[:, 1:, :] - r_face_l * F[:, :-1, :]) - \
+            (jnp.diff(G, axis=2) * inv_r_dx2) + S
+    return L, (F, G), speeds
+
+
+@named_scope("solve")
+def solve(hydro: Hydro, lattice: Lattice, U: ArrayLike, t: float, fields: dict[str, Array] = None) -> tuple[Array, Array, Array, Array]:
+    if lattice.coords == "cartesian":
+        return solve_cartesian(hydro, lattice, U, t, fields)
+    elif lattice.coords == "polar":
+        return solve_polar(hydro, lattice, U, t, fields)
+
+
+def step(hydro: Hydro, lattice: Lattice, U: ArrayLike, t: float, dt: float) -> tuple[Array, tuple[Array, Array], float]:
+    # U keeps its ghost zones for the whole run; they are refilled once per step and
+    # only the interior cells are updated
+    # every phase is named in profiles (see meena profile)
+    g = lattice.num_g
+    with named_scope("boundary"):
+        U = fill_ghosts(hydro, lattice, U, t)
+    U_C = strip_ghost_cells(U, g)
+
+    # position-dependent fields are evaluated once per step on the ghosted grid
+    with named_scope("fields"):
+        fields = cached_fields(hydro, lattice, t)
+    interior = slice_fields(fields, (slice(g, -g), slice(g, -g)))
+
+    L, (F, G), speeds = solve(hydro, lattice, U, t, fields)
+    with named_scope("source"):
+        S = hydro.source(to_config_layout(hydro, U_C), lattice.X1, lattice.X2, t, **field_kwargs(interior))
+    with named_scope("update"):
+        U = U.at[:, g:-g, g:-g].set(U_C + L * dt + to_variables_first(hydro, S) * dt)
+
+    # the wavespeeds of this solve set the timestep of the next step
+    with named_scope("timestep"):
+        if hydro.timestep():
+            dt_next = jnp.asarray(hydro.timestep(), dtype=U.dtype)
+        else:
+            dt_next = signal_timestep(hydro, lattice, speeds)
+    return U, (F, G), dt_next
+
+
+@partial(jit, static_argnames=["hydro", "lattice", "groups", "block"], donate_argnames=["U"])
+def advance(hydro: Hydro, lattice: Lattice, U: ArrayLike, t: float, dt: float, T: float, t_stop: float, n: int, n_stop: int, groups: tuple = (), windows: tuple = (), block: int = 1) -> tuple[Array, Array, Array, Array, Array, tuple, tuple]:
+    """
+        Advance the state by at least one and at most (n_stop - n) timesteps inside a single
+        compiled loop, stopping as soon as t reaches t_stop. t, the next timestep, the step
+        counter and the smallest dt taken are carried on device so the host only syncs once per call.
+        The buffer of U is donated.
+        Every step is added to the open window of each diagnostics group (see accumulate).
+        Completed windows are written into a (block, columns) buffer per group, which is
+        returned with the number of rows written, the state and the windows still open;
+        n_stop - n must not exceed block.
+    """
+    def cond(carry):
+        _, t, _, n_, _, _, _ = carry
+        return (n_ == n) | ((t < t_stop) & (t < T) & (n_ < n_stop))
+
+    def body(carry):
+        U, t, dt, n_, min_dt, windows, tables = carry
+        U_, (F, G), dt_next = step(hydro, lattice, U, t, dt)
+        windows_, tables_ = [], []
+        for (interval, group), window, (rows, k) in zip(groups, windows, tables):
+            with named_scope("diagnostics"):
+                window, rows, k = accumulate(hydro, lattice, interval, group, window, rows, k, U, F, G, t, dt)
+            windows_.append(window)
+            tables_.append((rows, k))
+        t = jnp.where(t + dt <= T, t + dt, T)
+        return U_, t, dt_next, n_ + 1, jnp.minimum(min_dt, dt), tuple(windows_), tuple(tables_)
+
+    t = jnp.asarray(t, dtype=U.dtype)
+    dt = jnp.asarray(dt, dtype=U.dtype)
+    tables = tuple(
+        (jnp.zeros((block, 2 + len(reductions(group))), dtype=U.dtype), jnp.asarray(0))
+        for _, group in groups
+    )
+    carry = (U, t, dt, jnp.asarray(n), jnp.asarray(jnp.inf, dtype=U.dtype), tuple(windows), tables)
+    return lax.while_loop(cond, body, carry)
+
+
+@partial(jit, static_argnames=["hydro", "lattice", "plot"])
 def get_matrix_to_plot(hydro: Hydro, lattice: Lattice, U: ArrayLike, t: float, plot: str):
+    # the plotted variable on the interior of the ghosted state U
+    U = strip_ghost_cells(U, lattice.num_g)
     rho, u, v, p = get_prims(hydro, U, lattice.X1, lattice.X2, t)
-    e = U[:, :, 3]
+    e = U[3]
     if plot == "density":
         matrix = rho
     elif plot == "log density":
@@ -107,70 +196,115 @@ def get_matrix_to_plot(hydro: Hydro, lattice: Lattice, U: ArrayLike, t: float, p
         
     return matrix
 
-def run(hydro, lattice, U, t=0, T=1, N=None, plot=None, plot_range=None, out="./out", save_interval=None, diagnostics: ArrayLike = []):
+def run(hydro, lattice, U, t=0, T=1, N=None, plot=None, plot_range=None, out="./out", save_interval=None, diagnostics: ArrayLike = [], steps_per_dispatch=None, diagnostics_csv=True, checkpoint_series=False, resume: RunState = None, plot_interval=0.5, plot_every=None):
     labels = {"density": r"$\rho$", "log density": r"$\log_{10} \Sigma$", "u": r"$u$",
               "v": r"$v$", "pressure": r"$P$", "energy": r"$E$", }
 
     saving = save_interval is not None
+    diagnostics = tuple(Diagnostic(*d) for d in diagnostics)
+    groups = diagnostic_groups(diagnostics)
+
+    # every run leaves a summary of its performance in out
+    os.makedirs(out, exist_ok=True)
 
-    if saving or len(diagnostics) > 0:
-        os.makedirs(out, exist_ok=True)
+    # a resumed run continues with the step count, timestep, checkpoint schedule and
+    # diagnostics windows it was saved with
+    n = resume.step if resume else 1
+    next_checkpoint = resume.next_checkpoint if resume else t
 
+    # snapshots and checkpoints from next_checkpoint on are replaced by this run
+    checkpoints = nullcontext()
     if saving:
+        # enough decimals in the file names to tell checkpoints apart
+        digits = max(2, math.ceil(-math.log10(save_interval)))
+    if saving and checkpoint_series:
+        # snapshots are appended to a single time-series file instead
+        store = TimeSeriesStore(f"{out}/snapshots.h5", hydro, lattice, next_checkpoint)
+        checkpoints = CheckpointWriter(hydro, lattice, store)
+    elif saving:
         os.makedirs(f"{out}/checkpoints", exist_ok=True)
+        catalog = CheckpointCatalog(f"{out}/checkpoints")
+        catalog.truncate(next_checkpoint)
+        # checkpoints are written to disk on a background thread while the run continues
+        checkpoints = CheckpointWriter(hydro, lattice, catalog=catalog)
 
+    writer = nullcontext()
     if len(diagnostics) > 0:
-        diag_file = f"{out}/diagnostics.csv"
-        if not os.path.isfile(diag_file):
-            headers = ["t", "dt"]
-            headers.extend([name for name, _ in diagnostics])
-            create_csv_file(diag_file, headers)
+        # rows are reduced and buffered on device and appended to a columnar file in blocks,
+        # one table per diagnostics interval
+        csv_file = f"{out}/diagnostics.csv" if diagnostics_csv else None
+        writer = DiagnosticsWriter(f"{out}/diagnostics.h5", group_tables(groups), csv_file)
 
+    viewer = nullcontext()
     if plot:
-        matrix = get_matrix_to_plot(hydro, lattice, U, t, plot)
-        fig, ax, c, cb = plot_grid(
-            matrix, label=labels[plot], coords=lattice.coords, x1=lattice.x1, x2=lattice.x2, vmin=None, vmax=None)
-        ax.set_title(f"t = {t:.2f}")
-        
-    with Logger() as logger:
-        n = 1
-        next_checkpoint = t
+        # frames are drawn by a separate process, every plot_every steps if given and
+        # otherwise every plot_interval seconds
+        viewer = LiveViewer(lattice, labels[plot], plot_range, plot_interval, plot_every)
+
+    block = steps_per_dispatch if steps_per_dispatch is not None else 1
+
+    # the state is allocated with its ghost zones once for the whole run
+    g = lattice.num_g
+    U = add_ghost_cells(U, g)
+    # t is carried on device in the precision of the state and ends exactly at T in that
+    # precision, so the loop below compares against the same value
+    T = float(jnp.asarray(T, dtype=U.dtype))
+    # t is passed to the compiled step as a float from the start, so the first dispatch
+    # compiles the same signature as every later one
+    t = float(t)
+    if resume:
+        dt = jnp.asarray(resume.dt, dtype=U.dtype)
+        windows = restore_windows(groups, resume.windows, t, U.dtype)
+    else:
+        dt = initial_timestep(hydro, lattice, U, t)
+        windows = open_windows(groups, t, U.dtype)
+    # diagnostics rows from the start of the open windows on are written again
+    for (interval, _), (t0, _, _) in zip(groups, windows):
+        writer.truncate(table_name(interval), float(t0))
+    if plot:
+        viewer.publish(np.asarray(get_matrix_to_plot(hydro, lattice, U, t, plot)), t, n)
+
+    logger = Logger(n_start=n, t_start=t, t_end=T if N is None else None, n_end=N)
+    with logger, writer, checkpoints, viewer:
         while (N is None and t < T) or (N is not None and n < N):
-            U_, flux, dt = first_order_step(hydro, lattice, U, t)
-
-            if len(diagnostics) > 0:
-                # save diagnostics
-                diag_values = [get_val(hydro, lattice, U, flux, t)
-                               for _, get_val in diagnostics]
-                values = [t, dt]
-                values.extend(diag_values)
-                append_row_csv(diag_file, values)
-    
             # at each checkpoint, save the conserved variables in every zone
             if saving and t >= next_checkpoint:
-                filename = f"{out}/checkpoints/out_{t:.2f}.h5"
-                save_to_h5(filename, t, U, hydro, lattice)
+                filename = f"{out}/checkpoints/out_{t:.{digits}f}.h5"
                 next_checkpoint += save_interval
-
-            U = U_
-
-            if plot:
-                matrix = get_matrix_to_plot(hydro, lattice, U, t, plot)
-                if plot_range:
-                    vmin, vmax = plot_range[0], plot_range[1]
-                else:
-                    vmin, vmax = jnp.min(matrix), jnp.max(matrix)
-                if lattice.coords == "cartesian":
-                    c.set_data(jnp.transpose(matrix))
-                elif lattice.coords == "polar":
-                    c.set_array(matrix.ravel())
-                c.set_clim(vmin=vmin, vmax=vmax)
-                cb.update_normal(c)
-                ax.set_title(f"t = {t:.2f}")
-                fig.canvas.draw()
-                plt.pause(0.001)
-
-            t = t + dt if (t + dt <= T) else T
-            n = n + 1
-
-            logger.update_logs(lattice, n, t, dt)
+                state = RunState(n, dt, next_checkpoint, flatten_windows(windows))
+                with logger.io():
+                    checkpoints.save(filename, t, strip_ghost_cells(U, g), state)
+
+            t_stop = next_checkpoint if saving else T
+            # return to the host at least once per logging window
+            n_stop = min(n + block, logger.n_start + logger.log_freq)
+            # the first dispatch takes a single step, so the logger's compile time is only compiling
+            if logger.compile_seconds is None:
+                n_stop = n + 1
+            if N is not None:
+                n_stop = min(n_stop, N)
+            if plot and viewer.next_step() is not None:
+                n_stop = min(n_stop, viewer.next_step())
+
+            U, t, dt, n_, min_dt, windows, tables = advance(hydro, lattice, U, t, dt, T, t_stop, n, n_stop, groups, windows, block)
+            t, n_ = float(t), int(n_)
+            with logger.io():
+                for (interval, _), (rows, k) in zip(groups, tables):
+                    writer.append(table_name(interval), rows[:int(k)])
+
+            if plot and viewer.due(n_):
+                viewer.publish(np.asarray(get_matrix_to_plot(hydro, lattice, U, t, plot)), t, n_)
+
+            logger.update_logs(lattice, n_, t, min_dt, steps=n_ - n)
+            n = n_
+
+        # windows still open at the end of the run are written with the length they reached,
+        # so integrals and means cover the whole run
+        with logger.io():
+            for (interval, group), window in zip(groups, windows):
+                if interval is not None and float(window[1]) > 0:
+                    writer.append(table_name(interval), window_row(group, window)[None, :])
+
+    # checkpoints are written in the background, so their time is reported apart from the time the run was blocked
+    logger.print_summary(lattice, n)
+    logger.write_summary(f"{out}/run_summary.json", lattice, n, checkpoint_seconds=getattr(checkpoints, "seconds", 0.0))